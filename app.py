@@ -1,19 +1,47 @@
-from flask import Flask, render_template, session, redirect, url_for, request
-from flask_socketio import SocketIO, emit
+import time
+STARTUP_BEGAN = time.perf_counter()  # taken before the heavy imports so they are counted
+
+from flask import Flask, render_template, session, redirect, url_for, request, Response, stream_with_context, make_response
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from datetime import datetime, timezone
 from better_profanity import profanity
+from collections import deque, OrderedDict, Counter
+from array import array
 import os
+import shutil
 import atexit
-import psutil
 import socket
 import json
+import threading
+import re
+import math
+import heapq
+import itertools
+import textwrap
+import bisect
+import argparse
+import csv
+import io
+import sys
+import zlib
+import html
+import gzip
+import hashlib
+
+try:
+    import brotli  # optional: also serve brotli-compressed assets
+except ImportError:
+    brotli = None
 
 # ============================================================================
 # CONFIGURATION & INITIALIZATION
 # ============================================================================
 
-socketio = SocketIO(async_mode="threading")
-profanity.load_censor_words()
+# Engine.IO gzips long-polling responses above this size; the threading
+# WebSocket transport has no permessage-deflate support.
+HTTP_COMPRESSION_THRESHOLD = 512  # bytes
+
+socketio = SocketIO(async_mode="threading", http_compression=True, compression_threshold=HTTP_COMPRESSION_THRESHOLD)
 
 # ============================================================================
 # UTILITY FUNCTIONS
@@ -24,55 +52,137 @@ def is_blacklisted(text: str) -> bool:
     return profanity.contains_profanity(text.lower())
 
 
+# better_profanity builds its default word set when it is imported; it is only
+# loaded here if that did not happen, and before any message can be checked.
+if not profanity.CENSOR_WORDSET:
+    profanity.load_censor_words()
+
+
+def write_json_atomic(path, data, **dump_options):
+    """Write JSON to a temp file and swap it in, so a crash never leaves a truncated file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_options)
+    os.replace(temp_path, path)
+
+
+# Admin tools (moderation queries, exports, profiling) are limited to these
+# IPs: the server machine itself plus any listed in LAN_HUB_ADMIN_IPS.
+ADMIN_IPS = {"127.0.0.1", "::1"} | {
+    ip.strip() for ip in os.environ.get("LAN_HUB_ADMIN_IPS", "").split(",") if ip.strip()
+}
+
+def is_admin() -> bool:
+    """Check if the current request comes from an admin IP"""
+    return request.remote_addr in ADMIN_IPS
+
+
 # ============================================================================
 # USER TRACKING FEATURE
 # ============================================================================
 
 USERS_FILE = "features/users.json"
+USERS_JOURNAL_FILE = "features/users.journal"  # user records changed since users.json was written
+USERS_JOURNAL_COMPACT_LINES = 1000  # fold the journal into users.json past this many records
+
+# The registry lives in memory; a change appends only the touched user's
+# record to the journal, and users.json is rewritten when the journal grows
+# long or the server stops.
+users_data = {}  # {ip: {username: user record}}
+registered_usernames = set()
+users_lock = threading.RLock()
+users_journal_lines = 0
+
+def channel_id_sort_key(channel_id):
+    """Order channel ids numerically (falling back to text for non-numeric ids)"""
+    return (0, int(channel_id), "") if channel_id.isdigit() else (1, 0, channel_id)
+
+def user_record_for_disk(user_data):
+    """Copy of a user record with its channel id sets as sorted lists"""
+    record = dict(user_data)
+    if "Channels" in record:
+        record["Channels"] = {
+            kind: sorted(ids, key=channel_id_sort_key) for kind, ids in record["Channels"].items()
+        }
+    return record
 
 def load_users():
-    """Load users data from disk"""
+    """Load users data from disk and the journal, with each user's channel lists as sets"""
+    global users_journal_lines
+    loaded = {}
     if os.path.exists(USERS_FILE):
         with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+            loaded = json.load(f)
+    users_journal_lines = 0
+    if os.path.exists(USERS_JOURNAL_FILE):
+        with open(USERS_JOURNAL_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ip, username, user_data = json.loads(line)
+                except ValueError:
+                    break  # a record torn by a crash mid-write
+                loaded.setdefault(ip, {})[username] = user_data
+                users_journal_lines += 1
+    for usernames_dict in loaded.values():
+        for user_data in usernames_dict.values():
+            if "Channels" in user_data:
+                user_data["Channels"]["created"] = set(user_data["Channels"].get("created", []))
+                user_data["Channels"]["joined"] = set(user_data["Channels"].get("joined", []))
+    return loaded
+
+def save_users():
+    """Write the whole registry to users.json and clear the journal"""
+    global users_journal_lines
+    with users_lock:
+        write_json_atomic(USERS_FILE, {
+            ip: {username: user_record_for_disk(user_data) for username, user_data in usernames_dict.items()}
+            for ip, usernames_dict in users_data.items()
+        }, indent=2, ensure_ascii=False)
+        if os.path.exists(USERS_JOURNAL_FILE):
+            os.remove(USERS_JOURNAL_FILE)
+        users_journal_lines = 0
 
-def save_users(users_data):
-    """Save users data to disk"""
-    os.makedirs("features", exist_ok=True)
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users_data, f, indent=2, ensure_ascii=False)
+def persist_users(*members):
+    """Append the current records of the given (ip, username) pairs to the journal"""
+    global users_journal_lines
+    with users_lock:
+        os.makedirs("features", exist_ok=True)
+        with open(USERS_JOURNAL_FILE, "a", encoding="utf-8") as f:
+            for ip, username in members:
+                user_data = users_data.get(ip, {}).get(username)
+                if user_data is not None:
+                    f.write(json.dumps([ip, username, user_record_for_disk(user_data)], ensure_ascii=False) + "\n")
+                    users_journal_lines += 1
+        if users_journal_lines >= USERS_JOURNAL_COMPACT_LINES:
+            save_users()
 
 def track_username(ip_address, username):
     """Track a new username for an IP address"""
-    users_data = load_users()
-    if ip_address not in users_data:
-        users_data[ip_address] = {}
-    
-    if username not in users_data[ip_address]:
-        users_data[ip_address][username] = {
-            "usernames_created": [username],
-            "Chat": {},
-            "Channels": {
-                "created": [],
-                "joined": []
+    with users_lock:
+        usernames_dict = users_data.setdefault(ip_address, {})
+        if username not in usernames_dict:
+            usernames_dict[username] = {
+                "usernames_created": [username],
+                "Chat": {},
+                "Channels": {
+                    "created": set(),
+                    "joined": set()
+                }
             }
-        }
-    else:
-        # Ensure usernames_created list exists and contains this username
-        if "usernames_created" not in users_data[ip_address][username]:
-            users_data[ip_address][username]["usernames_created"] = [username]
-        if username not in users_data[ip_address][username]["usernames_created"]:
-            users_data[ip_address][username]["usernames_created"].append(username)
-    
-    save_users(users_data)
+        else:
+            # Ensure usernames_created list exists and contains this username
+            if "usernames_created" not in usernames_dict[username]:
+                usernames_dict[username]["usernames_created"] = [username]
+            if username not in usernames_dict[username]["usernames_created"]:
+                usernames_dict[username]["usernames_created"].append(username)
+        registered_usernames.add(username)
+        persist_users((ip_address, username))
 
 def get_usernames_for_ip(ip_address):
     """Get all usernames created by an IP address"""
-    users_data = load_users()
-    if ip_address not in users_data:
-        return []
-    return list(users_data[ip_address].keys())
+    with users_lock:
+        return list(users_data.get(ip_address, {}).keys())
 
 def get_most_recent_username(ip_address):
     """Get the most recent (last) username for an IP address"""
@@ -81,33 +191,109 @@ def get_most_recent_username(ip_address):
 
 def is_valid_username_for_ip(ip_address, username):
     """Verify that a username is actually registered for an IP address in users.json"""
-    users_data = load_users()
-    return ip_address in users_data and username in users_data[ip_address]
+    with users_lock:
+        return username in users_data.get(ip_address, {})
 
 def username_exists(username):
     """Check if a username exists anywhere in users.json (across all IPs)"""
-    users_data = load_users()
-    for ip, usernames_dict in users_data.items():
-        if username in usernames_dict:
-            return True
-    return False
+    return username in registered_usernames
 
 def get_user_data(ip_address, username):
     """Get the full data object for a user"""
-    users_data = load_users()
-    if ip_address in users_data and username in users_data[ip_address]:
-        return users_data[ip_address][username]
-    return None
+    with users_lock:
+        return users_data.get(ip_address, {}).get(username)
+
+def get_user_channel_ids(ip_address, username):
+    """Copies of a user's created and joined channel id sets, or None for an unknown user"""
+    with users_lock:
+        user_data = users_data.get(ip_address, {}).get(username)
+        if user_data is None:
+            return None
+        channels_info = user_data.get("Channels", {})
+        return {"created": set(channels_info.get("created", ())), "joined": set(channels_info.get("joined", ()))}
 
 def update_user_data(ip_address, username, user_data):
     """Update the full data object for a user"""
-    users_data = load_users()
-    if ip_address not in users_data:
-        users_data[ip_address] = {}
-    users_data[ip_address][username] = user_data
-    save_users(users_data)
+    with users_lock:
+        users_data.setdefault(ip_address, {})[username] = user_data
+        registered_usernames.add(username)
+        persist_users((ip_address, username))
+
 
-users_data = load_users()
+# ============================================================================
+# ID ALLOCATION FEATURE
+# ============================================================================
+
+SEQUENCES_FILE = "features/sequences.json"
+ID_BLOCK_SIZE = 100  # ids reserved on disk at a time per stream
+ID_LOCK_STRIPES = 16
+CHAT_STREAM = "chat"
+CHANNELS_STREAM = "channels"  # channel ids and channel directory events
+GLOBAL_SEQUENCE = "global"  # one sequence across every stream, used for cursors
+
+
+def channel_stream(channel_id):
+    """Stream name used for a channel's message ids and events"""
+    return f"channel:{channel_id}"
+
+
+class IdAllocator:
+    """Hands out monotonic ids per stream, persisting high-water marks a block at a time.
+
+    Each stream hashes to one of a fixed set of locks, so allocations on
+    different streams rarely contend. After a restart allocation resumes above
+    the last persisted block, so ids are never reused even if the process died
+    without a clean shutdown.
+    """
+
+    def __init__(self, path, block_size=ID_BLOCK_SIZE, stripes=ID_LOCK_STRIPES):
+        self.path = path
+        self.block_size = block_size
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        self._persist_lock = threading.Lock()
+        self._reserved = {}  # {stream: first id not covered by the persisted block}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._reserved = json.load(f)
+        self._next = dict(self._reserved)  # {stream: next id to hand out}
+
+    def _lock_for(self, stream):
+        return self._stripes[hash(stream) % len(self._stripes)]
+
+    def next_id(self, stream):
+        """Allocate the next id of a stream (ids start at 1)"""
+        with self._lock_for(stream):
+            value = self._next.get(stream, 1)
+            self._next[stream] = value + 1
+            if value >= self._reserved.get(stream, 1):
+                self._reserved[stream] = value + self.block_size
+                self._persist()
+            return value
+
+    def peek(self, stream):
+        """Return the id the next allocation on a stream would get"""
+        with self._lock_for(stream):
+            return self._next.get(stream, 1)
+
+    def ensure_above(self, stream, used_id):
+        """Make sure future ids of a stream are greater than an id already in use"""
+        with self._lock_for(stream):
+            if self._next.get(stream, 1) <= used_id:
+                self._next[stream] = used_id + 1
+
+    def drop(self, stream):
+        """Forget a stream that will never allocate again"""
+        with self._lock_for(stream):
+            self._next.pop(stream, None)
+            if self._reserved.pop(stream, None) is not None:
+                self._persist()
+
+    def _persist(self):
+        with self._persist_lock:
+            write_json_atomic(self.path, dict(self._reserved), indent=2)
+
+
+id_allocator = IdAllocator(SEQUENCES_FILE)
 
 
 # ============================================================================
@@ -118,31 +304,39 @@ users_data = load_users()
 CHAT_RECENT_LIMIT = 100
 CHAT_FILE = "features/chat/chat.json"
 chat_messages = []
-chat_message_id_counter = 1
+chat_newest_on_disk = 0  # newest message id in chat.json when it was loaded
 CHAT_MAX_MESSAGE_LENGTH = 200  # character limit for messages
 
 
 def load_chat_messages():
-    """Load chat messages from disk into memory"""
-    global chat_message_id_counter
+    """Load the most recent chat messages from disk into memory"""
+    global chat_newest_on_disk
     if os.path.exists(CHAT_FILE):
         with open(CHAT_FILE, "r", encoding="utf-8") as f:
             messages_data = json.load(f)
-            for msg_data in messages_data:
+            if messages_data:
+                chat_newest_on_disk = max(msg_data["id"] for msg_data in messages_data)
+                id_allocator.ensure_above(CHAT_STREAM, chat_newest_on_disk)
+            for msg_data in messages_data[-CHAT_RECENT_LIMIT:]:
                 msg_obj = {
                     "id": msg_data["id"],
                     "username": msg_data["username"],
                     "message": msg_data["message"],
                     "timestamp": datetime.fromisoformat(msg_data["timestamp"]),
-                    "read_count": msg_data.get("read_count", 0),
-                    "read_users": set(),
                     "reply_to_id": msg_data.get("reply_to_id"),
                     "ip_address": msg_data.get("ip_address"),
-                    "edited": msg_data.get("edited", False)
+                    "edited": msg_data.get("edited", False),
+                    "read_count": msg_data.get("read_count", 0)  # stored count, a floor for the cursor count
                 }
+                if "reply_to_username" in msg_data:
+                    msg_obj["reply_to_username"] = msg_data["reply_to_username"]
+                    msg_obj["reply_to_message"] = msg_data["reply_to_message"]
                 chat_messages.append(msg_obj)
-                chat_message_id_counter = max(chat_message_id_counter, msg_data["id"] + 1)
-        chat_messages[:] = chat_messages[-CHAT_RECENT_LIMIT:]  # only keep recent in RAM
+
+
+def chat_read_count(msg):
+    """Number of users who have read a chat message"""
+    return message_read_count(CHAT_STREAM, msg)
 
 
 def get_message_by_id(msg_id):
@@ -167,11 +361,14 @@ def save_chat_message_to_disk(msg):
         "username": msg["username"],
         "message": msg["message"],
         "timestamp": msg["timestamp"].isoformat(),
-        "read_count": msg.get("read_count", 0),
+        "read_count": chat_read_count(msg),
         "reply_to_id": msg.get("reply_to_id"),
         "ip_address": msg.get("ip_address"),
         "edited": msg.get("edited", False)
     }
+    if "reply_to_username" in msg:
+        msg_data["reply_to_username"] = msg["reply_to_username"]
+        msg_data["reply_to_message"] = msg["reply_to_message"]
     existing_messages.append(msg_data)
     # Write back
     with open(CHAT_FILE, "w", encoding="utf-8") as f:
@@ -179,9 +376,10 @@ def save_chat_message_to_disk(msg):
 
 
 def save_all_chat_messages_to_disk():
-    """Save all in-memory chat messages to disk"""
+    """Save all in-memory chat messages to disk, keeping the older history already there"""
     if chat_messages:
         os.makedirs("features/chat", exist_ok=True)
+        oldest_in_memory = chat_messages[0]["id"]
         messages_data = []
         for msg in chat_messages:
             msg_data = {
@@ -189,20 +387,528 @@ def save_all_chat_messages_to_disk():
                 "username": msg["username"],
                 "message": msg["message"],
                 "timestamp": msg["timestamp"].isoformat(),
-                "read_count": msg.get("read_count", 0),
+                "read_count": chat_read_count(msg),
                 "reply_to_id": msg.get("reply_to_id"),
                 "ip_address": msg.get("ip_address"),
                 "edited": msg.get("edited", False)
             }
+            if "reply_to_username" in msg:
+                msg_data["reply_to_username"] = msg["reply_to_username"]
+                msg_data["reply_to_message"] = msg["reply_to_message"]
             messages_data.append(msg_data)
-        with open(CHAT_FILE, "w", encoding="utf-8") as f:
-            json.dump(messages_data, f, indent=2, ensure_ascii=False)
+        # Stream the older history into a new file instead of loading it
+        temp_file = CHAT_FILE + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write("[")
+            first = True
+            older = iter_json_array(CHAT_FILE) if os.path.exists(CHAT_FILE) else ()
+            for msg_data in itertools.chain((m for m in older if m["id"] < oldest_in_memory), messages_data):
+                f.write("\n" if first else ",\n")
+                f.write(textwrap.indent(json.dumps(msg_data, indent=2, ensure_ascii=False), "  "))
+                first = False
+            f.write("\n]")
+        os.replace(temp_file, CHAT_FILE)
         print(f"Saved {len(chat_messages)} chat messages to disk on shutdown.")
 
 
-# Load chat messages on startup
-load_chat_messages()
-server_start_time = datetime.now()  # Record when server starts (after loading old messages)
+
+
+# ============================================================================
+# CHAT SEARCH FEATURE
+# ============================================================================
+
+# Inverted index over global chat history, kept on disk as immutable segments.
+# Each segment has a term dictionary (token -> postings location), a postings
+# file of varint-encoded (id delta, term frequency) pairs, an NDJSON doc store
+# and a dense id -> doc offset table. New messages collect in an in-memory
+# segment that is flushed every SEARCH_FLUSH_THRESHOLD messages; edits and
+# deletes are kept as overrides until the segment holding them is rewritten.
+# Similar-sized segments are merged by a background thread that streams both
+# from disk, so a merge never loads the history into RAM or blocks sends.
+# The doc store keeps every field a chat page shows, so older pages of chat
+# history are read from it by id instead of parsing chat.json.
+SEARCH_DIR = "features/chat/search"
+SEARCH_DOC_VERSION = 3  # bumped when docs gain fields; older indexes are rebuilt
+SEARCH_DOC_FIELDS = ("ip_address", "reply_to_id", "reply_to_username", "reply_to_message", "read_count")
+SEARCH_FLUSH_THRESHOLD = 256  # messages buffered in memory before writing a segment
+SEARCH_MAX_QUERY_TOKENS = 8
+SEARCH_PAGE_SIZE = 20
+SEARCH_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Split text into lowercase search tokens"""
+    return SEARCH_TOKEN_RE.findall(text.lower())
+
+
+def encode_varint(value, out):
+    """Append an unsigned LEB128 varint to a bytearray"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data):
+    """Decode a byte string of unsigned LEB128 varints"""
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+class SearchSegment:
+    """One immutable on-disk segment of the chat search index"""
+
+    def __init__(self, directory, name):
+        self.base = os.path.join(directory, name)
+        self.name = name
+        with open(self.base + ".terms.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.min_id = meta["min_id"]
+        self.max_id = meta["max_id"]
+        self.doc_count = meta["doc_count"]
+        self.terms = meta["terms"]  # {token: [offset, length, document frequency]}
+
+    @staticmethod
+    def write(directory, name, docs, postings=None):
+        """Write docs (an iterable in id order, each with its current text) as a new segment.
+
+        postings, if given, yields (token, [(id, term frequency)] in id order)
+        for the same docs, so a merge never holds more than one token's list;
+        otherwise postings are built from the doc text.
+        """
+        collected = {} if postings is None else None
+        base = os.path.join(directory, name)
+        os.makedirs(directory, exist_ok=True)
+        min_id = max_id = None
+        doc_count = 0
+
+        # The id -> offset table is dense: ids missing from the segment get -1
+        with open(base + ".docs", "wb") as f, open(base + ".doff", "wb") as offsets_file:
+            for doc in docs:
+                if min_id is None:
+                    min_id = doc["id"]
+                else:
+                    (array("q", [-1]) * (doc["id"] - max_id - 1)).tofile(offsets_file)
+                array("q", [f.tell()]).tofile(offsets_file)
+                max_id = doc["id"]
+                doc_count += 1
+                f.write(json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n")
+                if collected is None or doc.get("deleted"):
+                    continue
+                for token, tf in Counter(tokenize(doc["message"])).items():
+                    collected.setdefault(token, []).append((doc["id"], tf))
+
+        terms = {}
+        with open(base + ".post", "wb") as f:
+            for token, entries in (postings if collected is None else collected.items()):
+                data = bytearray()
+                previous = 0
+                for msg_id, tf in entries:
+                    encode_varint(msg_id - previous, data)
+                    encode_varint(tf, data)
+                    previous = msg_id
+                terms[token] = [f.tell(), len(data), len(entries)]
+                f.write(data)
+
+        with open(base + ".terms.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "min_id": min_id,
+                "max_id": max_id,
+                "doc_count": doc_count,
+                "terms": terms
+            }, f, ensure_ascii=False)
+        return SearchSegment(directory, name)
+
+    @staticmethod
+    def merge(directory, name, older, newer, edits, deleted):
+        """Stream two segments into a new one, folding in the edits and deletes of their docs"""
+        def docs():
+            # Id ranges can overlap when messages were indexed out of order
+            for doc in heapq.merge(older.iter_docs(), newer.iter_docs(), key=lambda doc: doc["id"]):
+                if doc["id"] in deleted:
+                    doc["deleted"] = True
+                elif doc["id"] in edits:
+                    doc["message"] = edits[doc["id"]]
+                    doc["edited"] = True
+                yield doc
+
+        edited_postings = {}  # {token: {id: term frequency}} of the edited texts
+        for msg_id, text in edits.items():
+            if msg_id not in deleted:
+                for token, tf in Counter(tokenize(text)).items():
+                    edited_postings.setdefault(token, {})[msg_id] = tf
+        changed = set(edits) | set(deleted)
+
+        def postings():
+            with open(older.base + ".post", "rb") as older_file, open(newer.base + ".post", "rb") as newer_file:
+                for token in sorted(set(older.terms) | set(newer.terms) | set(edited_postings)):
+                    entries = {msg_id: tf for segment, f in ((older, older_file), (newer, newer_file))
+                               for msg_id, tf in segment.postings(token, f).items() if msg_id not in changed}
+                    entries.update(edited_postings.get(token, {}))
+                    if entries:
+                        yield token, sorted(entries.items())
+
+        return SearchSegment.write(directory, name, docs(), postings())
+
+    def postings(self, token, f=None):
+        """Return {id: term frequency} for a token, reading from f if the .post file is already open"""
+        entry = self.terms.get(token)
+        if entry is None:
+            return {}
+        offset, length, _ = entry
+        if f is None:
+            with open(self.base + ".post", "rb") as f:
+                f.seek(offset)
+                values = decode_varints(f.read(length))
+        else:
+            f.seek(offset)
+            values = decode_varints(f.read(length))
+        result = {}
+        msg_id = 0
+        for n in range(0, len(values), 2):
+            msg_id += values[n]
+            result[msg_id] = values[n + 1]
+        return result
+
+    def document_frequency(self, token):
+        entry = self.terms.get(token)
+        return entry[2] if entry else 0
+
+    def doc_offset(self, msg_id):
+        """Offset of a message in the doc store, or -1 if it is not in this segment"""
+        if not self.min_id <= msg_id <= self.max_id:
+            return -1
+        with open(self.base + ".doff", "rb") as f:
+            f.seek((msg_id - self.min_id) * 8)
+            return array("q", f.read(8))[0]
+
+    def get_doc(self, msg_id):
+        """Read one stored message by id, or None if it is not in this segment"""
+        offset = self.doc_offset(msg_id)
+        if offset < 0:
+            return None
+        with open(self.base + ".docs", "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def docs_before(self, before_id, limit):
+        """Read up to limit docs with ids below before_id, newest first"""
+        docs = []
+        last = min(self.max_id, before_id - 1)
+        with open(self.base + ".doff", "rb") as offsets_file, open(self.base + ".docs", "rb") as docs_file:
+            while last >= self.min_id and len(docs) < limit:
+                first = max(self.min_id, last - limit + 1)
+                offsets_file.seek((first - self.min_id) * 8)
+                offsets = array("q", offsets_file.read((last - first + 1) * 8))
+                for msg_id in range(last, first - 1, -1):
+                    offset = offsets[msg_id - first]
+                    if offset >= 0 and len(docs) < limit:
+                        docs_file.seek(offset)
+                        docs.append(json.loads(docs_file.readline()))
+                last = first - 1
+        return docs
+
+    def iter_docs(self):
+        with open(self.base + ".docs", "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def remove_files(self):
+        for suffix in (".terms.json", ".post", ".docs", ".doff"):
+            try:
+                os.remove(self.base + suffix)
+            except FileNotFoundError:
+                pass
+
+
+class ChatSearchIndex:
+    """Incrementally maintained full-text index over global chat messages"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.segments = []
+        self.next_segment = 1
+        self.max_id = 0  # newest message id indexed (flushed or pending)
+        self.pending_docs = {}  # {id: doc} not yet written to a segment
+        self.pending_postings = {}  # {token: {id: term frequency}}
+        self.edits = {}  # {id: edited text} for messages already in a segment
+        self.deleted = set()  # ids deleted after being written to a segment
+        self.doc_version = SEARCH_DOC_VERSION
+        self.merging = False  # a background merge thread is running
+
+        meta_path = os.path.join(directory, "index.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.doc_version = meta.get("doc_version", 1)
+            self.segments = [SearchSegment(directory, name) for name in meta["segments"]]
+            self.next_segment = meta["next_segment"]
+            self.max_id = meta["max_id"]
+            self.edits = {int(msg_id): text for msg_id, text in meta.get("edits", {}).items()}
+            self.deleted = set(meta.get("deleted", []))
+
+    def add(self, msg):
+        """Index a new chat message"""
+        doc = {
+            "id": msg["id"],
+            "username": msg["username"],
+            "message": msg["message"],
+            "timestamp": msg["timestamp"] if isinstance(msg["timestamp"], str) else msg["timestamp"].isoformat()
+        }
+        for key in SEARCH_DOC_FIELDS:
+            if msg.get(key) is not None:
+                doc[key] = msg[key]
+        with self.lock:
+            # Ids are allocated before the message reaches the index, so they may arrive out of order
+            if self.contains(doc["id"]):
+                return
+            self.pending_docs[doc["id"]] = doc
+            for token, tf in Counter(tokenize(doc["message"])).items():
+                self.pending_postings.setdefault(token, {})[doc["id"]] = tf
+            self.max_id = max(self.max_id, doc["id"])
+            if len(self.pending_docs) >= SEARCH_FLUSH_THRESHOLD:
+                self.flush()
+
+    def contains(self, msg_id):
+        """Check whether a message is already indexed, pending or in a segment"""
+        with self.lock:
+            if msg_id in self.pending_docs:
+                return True
+            return any(segment.doc_offset(msg_id) >= 0 for segment in self.segments)
+
+    def update(self, msg_id, text):
+        """Re-index an edited message"""
+        with self.lock:
+            if msg_id in self.pending_docs:
+                self._unindex_pending(msg_id)
+                self.pending_docs[msg_id]["message"] = text
+                self.pending_docs[msg_id]["edited"] = True
+                for token, tf in Counter(tokenize(text)).items():
+                    self.pending_postings.setdefault(token, {})[msg_id] = tf
+            else:
+                self.edits[msg_id] = text
+                self._save_meta()
+
+    def delete(self, msg_id):
+        """Remove a deleted message from search results"""
+        with self.lock:
+            if msg_id in self.pending_docs:
+                self._unindex_pending(msg_id)
+                self.pending_docs[msg_id]["deleted"] = True
+            else:
+                self.deleted.add(msg_id)
+                self.edits.pop(msg_id, None)
+                self._save_meta()
+
+    def get_doc(self, msg_id):
+        """Return the stored copy of a message, with any later edit or delete applied"""
+        with self.lock:
+            doc = self.pending_docs.get(msg_id)
+            if doc is None:
+                # Segment id ranges can overlap when messages were indexed out of order
+                for segment in reversed(self.segments):
+                    doc = segment.get_doc(msg_id)
+                    if doc is not None:
+                        break
+            return self._current(doc) if doc is not None else None
+
+    def docs_before(self, before_id, limit):
+        """Return up to limit stored messages with ids below before_id, oldest first"""
+        with self.lock:
+            docs = [doc for msg_id, doc in self.pending_docs.items() if msg_id < before_id]
+            for segment in self.segments:
+                docs.extend(segment.docs_before(before_id, limit))
+            newest = heapq.nlargest(limit, docs, key=lambda doc: doc["id"])
+            return [self._current(doc) for doc in reversed(newest)]
+
+    def _current(self, doc):
+        """Copy of a stored doc with any later edit or delete applied"""
+        doc = dict(doc)
+        if doc["id"] in self.deleted:
+            doc["deleted"] = True
+        elif doc["id"] in self.edits:
+            doc["message"] = self.edits[doc["id"]]
+            doc["edited"] = True
+        if doc.get("deleted"):
+            doc["message"] = "[deleted]"
+        return doc
+
+    def search(self, query, offset=0, limit=SEARCH_PAGE_SIZE):
+        """Return (total hits, ranked page of docs) for messages containing every query token"""
+        tokens = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_QUERY_TOKENS]
+        if not tokens:
+            return 0, []
+
+        with self.lock:
+            total_docs = len(self.pending_docs) + sum(segment.doc_count for segment in self.segments)
+            df = {}
+            for token in tokens:
+                df[token] = len(self.pending_postings.get(token, ())) + sum(
+                    segment.document_frequency(token) for segment in self.segments)
+            idf = {token: math.log(1 + total_docs / max(df[token], 1)) for token in tokens}
+            # Intersect starting from the rarest token to keep candidate sets small
+            ordered = sorted(tokens, key=lambda token: df[token])
+
+            scores = {}
+            sources = [self.pending_postings.get] + [segment.postings for segment in self.segments]
+            for lookup in sources:
+                matched = None
+                for token in ordered:
+                    postings = lookup(token) or {}
+                    if matched is None:
+                        matched = {msg_id: idf[token] * tf / (tf + 1.2) for msg_id, tf in postings.items()}
+                    else:
+                        matched = {msg_id: score + idf[token] * postings[msg_id] / (postings[msg_id] + 1.2)
+                                   for msg_id, score in matched.items() if msg_id in postings}
+                    if not matched:
+                        break
+                for msg_id, score in (matched or {}).items():
+                    if msg_id not in self.edits and msg_id not in self.deleted:
+                        scores[msg_id] = score
+
+            # Edited messages are matched against their current text
+            for msg_id, text in self.edits.items():
+                counts = Counter(tokenize(text))
+                if all(token in counts for token in tokens):
+                    scores[msg_id] = sum(idf[token] * counts[token] / (counts[token] + 1.2) for token in tokens)
+
+            ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+            page = []
+            for msg_id, score in ranked[offset:]:
+                doc = self.get_doc(msg_id)
+                if doc is not None:
+                    doc["score"] = round(score, 3)
+                    page.append(doc)
+            return len(scores), page
+
+    def flush(self):
+        """Write pending messages to a new segment; similar-sized segments are merged in the background"""
+        with self.lock:
+            if not self.pending_docs:
+                return
+            docs = [self.pending_docs[msg_id] for msg_id in sorted(self.pending_docs)]
+            self.segments.append(SearchSegment.write(self.directory, self._new_segment_name(), docs))
+            self.pending_docs = {}
+            self.pending_postings = {}
+            self._save_meta()
+            if not self.merging and self._merge_candidate() is not None:
+                self.merging = True
+                threading.Thread(target=self._merge_loop, name="search-merge", daemon=True).start()
+
+    def _merge_candidate(self):
+        """The newest adjacent pair whose newer segment is at least as big as the older one.
+
+        Merging those keeps the segment count logarithmic in the number of messages.
+        """
+        for position in range(len(self.segments) - 2, -1, -1):
+            if self.segments[position + 1].doc_count >= self.segments[position].doc_count:
+                return self.segments[position], self.segments[position + 1]
+        return None
+
+    def _merge_loop(self):
+        """Merge segments until none qualify. Segment files are streamed, and the index
+        lock is only held to pick a pair and to swap in the result, so sends and
+        searches carry on during a merge."""
+        try:
+            while True:
+                with self.lock:
+                    pair = self._merge_candidate()
+                    if pair is None:
+                        self.merging = False
+                        return
+                    older, newer = pair
+                    in_pair = lambda msg_id: older.doc_offset(msg_id) >= 0 or newer.doc_offset(msg_id) >= 0
+                    edits = {msg_id: text for msg_id, text in self.edits.items() if in_pair(msg_id)}
+                    deleted = {msg_id for msg_id in self.deleted if in_pair(msg_id)}
+                    name = self._new_segment_name()
+                
+                merged = SearchSegment.merge(self.directory, name, older, newer, edits, deleted)
+                
+                with self.lock:
+                    if older not in self.segments:
+                        merged.remove_files()  # the index was reset meanwhile
+                        continue
+                    position = self.segments.index(older)
+                    self.segments[position:position + 2] = [merged]
+                    # Overrides made during the merge are newer than the folded ones and stay
+                    for msg_id, text in edits.items():
+                        if self.edits.get(msg_id) == text:
+                            del self.edits[msg_id]
+                    self.deleted -= deleted
+                    self._save_meta()
+                older.remove_files()
+                newer.remove_files()
+        except Exception as e:
+            print(f"ERROR merging search segments: {e}")
+            with self.lock:
+                self.merging = False
+
+    def reset(self):
+        """Drop every segment, e.g. to rebuild with a newer doc layout"""
+        with self.lock:
+            for segment in self.segments:
+                segment.remove_files()
+            self.segments = []
+            self.max_id = 0
+            self.pending_docs = {}
+            self.pending_postings = {}
+            self.edits = {}
+            self.deleted = set()
+            self.doc_version = SEARCH_DOC_VERSION
+            self._save_meta()
+
+    def _new_segment_name(self):
+        name = f"seg_{self.next_segment}"
+        self.next_segment += 1
+        return name
+
+    def _unindex_pending(self, msg_id):
+        for token in set(tokenize(self.pending_docs[msg_id]["message"])):
+            postings = self.pending_postings.get(token)
+            if postings:
+                postings.pop(msg_id, None)
+
+    def _save_meta(self):
+        # Only flushed messages count towards max_id on disk, so pending ones are
+        # re-indexed from chat history after a crash
+        flushed_max = max((segment.max_id for segment in self.segments), default=0)
+        write_json_atomic(os.path.join(self.directory, "index.json"), {
+            "segments": [segment.name for segment in self.segments],
+            "next_segment": self.next_segment,
+            "max_id": flushed_max,
+            "doc_version": self.doc_version,
+            "edits": self.edits,
+            "deleted": sorted(self.deleted)
+        }, ensure_ascii=False)
+
+
+def index_missing_chat_messages():
+    """Index chat history written since the search index was last flushed"""
+    if search_index.doc_version < SEARCH_DOC_VERSION:
+        print("Rebuilding the chat search index for the current doc layout")
+        search_index.reset()
+    newest_indexed = search_index.max_id
+    if newest_indexed < chat_newest_on_disk and os.path.exists(CHAT_FILE):
+        with open(CHAT_FILE, "r", encoding="utf-8") as f:
+            for msg_data in json.load(f):
+                if msg_data["id"] > newest_indexed:
+                    search_index.add(msg_data)
+    # Snapshot: handlers keep appending (and trimming) while this runs; their
+    # own index writes are queued behind indexes_ready
+    for msg in list(chat_messages):
+        search_index.add(msg)
+
+
+search_index = ChatSearchIndex(SEARCH_DIR)
 
 
 # ============================================================================
@@ -211,7 +917,16 @@ server_start_time = datetime.now()  # Record when server starts (after loading o
 
 CHANNELS_FILE = "features/channels/channels.json"
 CHANNEL_TAGS_FILE = "features/channels/channel_tags.json"
-channels_data = {}  # In-memory storage: {channel_id: {info, messages}}
+CHANNEL_ARCHIVE_DIR = "features/channels/archive"
+CHANNEL_RECENT_LIMIT = 100  # messages kept in RAM per channel
+CHANNEL_ARCHIVE_BATCH = 50  # extra messages allowed before the oldest are archived
+CHANNEL_ARCHIVE_SEGMENT_SIZE = 500  # message ids per archive segment file
+CHANNEL_SEGMENT_CACHE_LIMIT = 16  # archive segments kept in RAM after paging in
+CHANNEL_PAGE_SIZE = 100
+channels_data = {}  # In-memory storage: {channel_id: {info, recent messages}}
+channel_members = {}  # Reverse index: {channel_id: set of (ip_address, username)}
+channel_segment_cache = OrderedDict()  # {(channel_id, segment): messages}, least recently used first
+channel_archive_lock = threading.Lock()
 
 def load_channel_tags():
     """Load all channel tags from disk"""
@@ -222,24 +937,16 @@ def load_channel_tags():
 
 def save_channel_tags(tags_data):
     """Save all channel tags to disk"""
-    os.makedirs("features/channels", exist_ok=True)
-    with open(CHANNEL_TAGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(tags_data, f, indent=2, ensure_ascii=False)
+    write_json_atomic(CHANNEL_TAGS_FILE, tags_data, indent=2, ensure_ascii=False)
 
 def add_new_tags(tags):
-    """Add new tags to the channel_tags.json file"""
+    """Count tag usage; the tag service writes channel_tags.json in batches"""
     if not tags:
         return
-    tags_data = load_channel_tags()
-    for tag in tags:
-        tag_lower = tag.lower()
-        if tag_lower not in tags_data:
-            tags_data[tag_lower] = {"name": tag, "count": 0}
-        tags_data[tag_lower]["count"] = tags_data[tag_lower].get("count", 0) + 1
-    save_channel_tags(tags_data)
-
-def load_channels():
-    """Load all channels from disk"""
+    tag_service.record(tags)
+
+def load_channels(read_only=False):
+    """Load all channels from disk; read_only leaves every file untouched"""
     global channels_data
     if os.path.exists(CHANNELS_FILE):
         with open(CHANNELS_FILE, "r", encoding="utf-8") as f:
@@ -252,12 +959,28 @@ def load_channels():
                     "tags": channel_info.get("tags", []),
                     "creator": channel_info.get("creator", ""),
                     "created_at": channel_info.get("created_at", ""),
-                    "messages": channel_info.get("messages", [])
+                    "messages": channel_info.get("messages", []),
+                    "activity": channel_info.get("activity", {})
                 }
+                for msg in channels_data[channel_id]["messages"]:
+                    # Older files kept the readers of each message: carry them over to read
+                    # cursors; the stored read_count stays as a floor for the derived count
+                    for reader in msg.pop("read_users", ()):
+                        read_cursors.seed(channel_stream(channel_id), reader, msg["id"])
+                if channel_id.isdigit():
+                    id_allocator.ensure_above(CHANNELS_STREAM, int(channel_id))
+                # next_message_id is kept for files from before sequences.json existed
+                id_allocator.ensure_above(channel_stream(channel_id), channel_info.get("next_message_id", 1) - 1)
+                if channels_data[channel_id]["messages"]:
+                    id_allocator.ensure_above(channel_stream(channel_id), channels_data[channel_id]["messages"][-1]["id"])
+                # Older files kept every message here; move the overflow to the archive
+                if not read_only:
+                    archive_old_channel_messages(channel_id, keep=CHANNEL_RECENT_LIMIT)
+    if not read_only:
+        read_cursors.flush()
 
 def save_channels():
     """Save all channels to disk"""
-    os.makedirs("features/channels", exist_ok=True)
     data = {}
     for channel_id, channel_info in channels_data.items():
         data[channel_id] = {
@@ -266,15 +989,108 @@ def save_channels():
             "tags": channel_info["tags"],
             "creator": channel_info["creator"],
             "created_at": channel_info["created_at"],
-            "messages": channel_info["messages"]
+            "messages": channel_info["messages"],
+            "next_message_id": id_allocator.peek(channel_stream(channel_id)),
+            "activity": channel_info["activity"]
         }
-    with open(CHANNELS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    write_json_atomic(CHANNELS_FILE, data, indent=2, ensure_ascii=False)
+
+def get_archive_segment_path(channel_id, segment):
+    """Path of the archive file holding one segment of a channel's messages"""
+    return os.path.join(CHANNEL_ARCHIVE_DIR, channel_id, f"{segment}.json")
+
+def get_archive_segment(msg_id):
+    """Archive segment a channel message id belongs to"""
+    return (msg_id - 1) // CHANNEL_ARCHIVE_SEGMENT_SIZE
+
+def load_archive_segment(channel_id, segment):
+    """Load one archive segment, keeping recently used segments cached (call with the archive lock held)"""
+    key = (channel_id, segment)
+    if key in channel_segment_cache:
+        channel_segment_cache.move_to_end(key)
+        return channel_segment_cache[key]
+    
+    messages = []
+    path = get_archive_segment_path(channel_id, segment)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            messages = json.load(f)
+    
+    channel_segment_cache[key] = messages
+    if len(channel_segment_cache) > CHANNEL_SEGMENT_CACHE_LIMIT:
+        channel_segment_cache.popitem(last=False)
+    return messages
+
+def archive_old_channel_messages(channel_id, keep=CHANNEL_RECENT_LIMIT):
+    """Move all but the newest `keep` messages of a channel to its archive segments"""
+    messages = channels_data[channel_id]["messages"]
+    if len(messages) <= keep:
+        return
+    overflow = messages[:-keep]
+    
+    by_segment = {}
+    for msg in overflow:
+        by_segment.setdefault(get_archive_segment(msg["id"]), []).append(msg)
+    
+    with channel_archive_lock:
+        for segment, segment_messages in by_segment.items():
+            archived = load_archive_segment(channel_id, segment)
+            # Skip messages already archived before a crash kept channels.json from being trimmed
+            newest_archived = archived[-1]["id"] if archived else 0
+            segment_messages = [msg for msg in segment_messages if msg["id"] > newest_archived]
+            if not segment_messages:
+                continue
+            archived.extend(segment_messages)
+            # The segment is the only copy of these messages once channels.json is trimmed
+            write_json_atomic(get_archive_segment_path(channel_id, segment), archived, ensure_ascii=False)
+    
+    messages[:] = messages[-keep:]
+
+def delete_channel_archive(channel_id):
+    """Remove a channel's archive segments from disk and from the cache"""
+    with channel_archive_lock:
+        for key in [key for key in channel_segment_cache if key[0] == channel_id]:
+            del channel_segment_cache[key]
+        shutil.rmtree(os.path.join(CHANNEL_ARCHIVE_DIR, channel_id), ignore_errors=True)
+
+def get_channel_messages_before(channel_id, last_id, limit=CHANNEL_PAGE_SIZE):
+    """Return up to `limit` channel messages older than last_id, paging in archive segments as needed"""
+    channel = channels_data[channel_id]
+    page = [msg for msg in channel["messages"] if msg["id"] < last_id]
+    
+    # Archived ids all sit below the oldest message still in RAM
+    boundary = channel["messages"][0]["id"] if channel["messages"] else id_allocator.peek(channel_stream(channel_id))
+    newest_archived = min(last_id, boundary) - 1
+    segment = get_archive_segment(newest_archived) if newest_archived > 0 else -1
+    
+    with channel_archive_lock:
+        while len(page) < limit and segment >= 0:
+            archived = [msg for msg in load_archive_segment(channel_id, segment) if msg["id"] <= newest_archived]
+            page = archived + page
+            segment -= 1
+    
+    return page[-limit:]
+
+def get_channel_message(channel_id, msg_id):
+    """Look up a single channel message by id in RAM or its archive segment"""
+    channel = channels_data.get(channel_id)
+    if channel is None:
+        return None
+    if channel["messages"] and msg_id >= channel["messages"][0]["id"]:
+        for msg in channel["messages"]:
+            if msg["id"] == msg_id:
+                return msg
+        return None
+    with channel_archive_lock:
+        for msg in load_archive_segment(channel_id, get_archive_segment(msg_id)):
+            if msg["id"] == msg_id:
+                return msg
+    return None
 
 def create_channel(title, description, tags, creator_username, creator_ip):
     """Create a new channel"""
     try:
-        channel_id = str(len(channels_data) + 1)
+        channel_id = str(id_allocator.next_id(CHANNELS_STREAM))
         channels_data[channel_id] = {
             "id": channel_id,
             "title": title,
@@ -282,17 +1098,22 @@ def create_channel(title, description, tags, creator_username, creator_ip):
             "tags": tags,
             "creator": creator_username,
             "created_at": datetime.now().isoformat(),
-            "messages": []
+            "messages": [],
+            "activity": {}
         }
         
-        # Add to user's created channels
-        user_data = get_user_data(creator_ip, creator_username)
+        # Add to user's created channels; records are only changed under users_lock
+        with users_lock:
+            user_data = get_user_data(creator_ip, creator_username)
+            if user_data:
+                if "Channels" not in user_data:
+                    user_data["Channels"] = {"created": set(), "joined": set()}
+                user_data["Channels"]["created"].add(channel_id)
+                user_data["Channels"]["joined"].add(channel_id)  # Creator is also joined
+                update_user_data(creator_ip, creator_username, user_data)
         if user_data:
-            if "Channels" not in user_data:
-                user_data["Channels"] = {"created": [], "joined": []}
-            user_data["Channels"]["created"].append(channel_id)
-            user_data["Channels"]["joined"].append(channel_id)  # Creator is also joined
-            update_user_data(creator_ip, creator_username, user_data)
+            channel_members[channel_id] = {(creator_ip, creator_username)}
+            read_cursors.advance(channel_stream(channel_id), creator_username, 0)
             print(f"DEBUG: Updated user data for {creator_username}")
         else:
             print(f"WARNING: Could not find user data for {creator_username} at {creator_ip}")
@@ -315,18 +1136,20 @@ def delete_channel(channel_id, creator_ip, creator_username):
         return False
     
     del channels_data[channel_id]
+    delete_channel_archive(channel_id)
+    id_allocator.drop(channel_stream(channel_id))
+    read_cursors.drop(channel_stream(channel_id))
+    after_indexes_ready(history_index.drop_stream, channel_stream(channel_id))
     
-    # Remove from all users
-    users_data = load_users()
-    for ip, usernames_dict in users_data.items():
-        for username, user_data in usernames_dict.items():
-            if "Channels" in user_data:
-                if channel_id in user_data["Channels"]["created"]:
-                    user_data["Channels"]["created"].remove(channel_id)
-                if channel_id in user_data["Channels"]["joined"]:
-                    user_data["Channels"]["joined"].remove(channel_id)
-    
-    save_users(users_data)
+    # Remove from its members only, found through the reverse index
+    members = channel_members.pop(channel_id, set())
+    with users_lock:
+        for ip, username in members:
+            user_data = users_data.get(ip, {}).get(username)
+            if user_data and "Channels" in user_data:
+                user_data["Channels"]["created"].discard(channel_id)
+                user_data["Channels"]["joined"].discard(channel_id)
+        persist_users(*members)
     save_channels()
     return True
 
@@ -335,75 +1158,1579 @@ def join_channel(channel_id, username, ip_address):
     if channel_id not in channels_data:
         return False
     
-    user_data = get_user_data(ip_address, username)
+    with users_lock:
+        user_data = get_user_data(ip_address, username)
+        if user_data:
+            if "Channels" not in user_data:
+                user_data["Channels"] = {"created": set(), "joined": set()}
+            user_data["Channels"]["joined"].add(channel_id)
+            update_user_data(ip_address, username, user_data)
     if user_data:
-        if "Channels" not in user_data:
-            user_data["Channels"] = {"created": [], "joined": []}
-        if channel_id not in user_data["Channels"]["joined"]:
-            user_data["Channels"]["joined"].append(channel_id)
-        update_user_data(ip_address, username, user_data)
+        channel_members.setdefault(channel_id, set()).add((ip_address, username))
+        # Earlier history is not counted as unread for a new member
+        messages = channels_data[channel_id]["messages"]
+        read_cursors.advance(channel_stream(channel_id), username, messages[-1]["id"] if messages else 0)
     return True
 
 def leave_channel(channel_id, username, ip_address):
     """Remove user from a channel"""
-    user_data = get_user_data(ip_address, username)
-    if user_data:
-        if "Channels" in user_data:
-            if channel_id in user_data["Channels"]["joined"] and channel_id not in user_data["Channels"]["created"]:
-                user_data["Channels"]["joined"].remove(channel_id)
-            update_user_data(ip_address, username, user_data)
+    with users_lock:
+        user_data = get_user_data(ip_address, username)
+        if user_data:
+            if "Channels" in user_data:
+                if channel_id not in user_data["Channels"]["created"]:
+                    user_data["Channels"]["joined"].discard(channel_id)
+                    channel_members.get(channel_id, set()).discard((ip_address, username))
+                update_user_data(ip_address, username, user_data)
     return True
 
-def search_channels(query, tags_filter=None):
-    """Search channels by title, description, or tags"""
-    results = []
-    query_lower = query.lower()
-    
-    for channel_id, channel_info in channels_data.items():
-        title_match = query_lower in channel_info["title"].lower()
-        desc_match = query_lower in channel_info["description"].lower()
-        id_match = query_lower in channel_id.lower()
-        tags_match = False
-        
-        if tags_filter:
-            tags_match = any(tag.lower() in [t.lower() for t in channel_info["tags"]] for tag in tags_filter)
-        
-        if title_match or desc_match or id_match or (tags_filter and tags_match):
-            results.append({
-                "id": channel_id,
-                "title": channel_info["title"],
-                "description": channel_info["description"],
-                "tags": channel_info["tags"],
-                "creator": channel_info["creator"],
-                "member_count": 0  # Could track this if needed
-            })
-    
-    return results
+def search_channels(query, tags_filter=None):
+    """Search channels by title, description, or tags"""
+    results = []
+    query_lower = query.lower()
+    
+    for channel_id, channel_info in channels_data.items():
+        # An empty query matches everything unless only tags are being searched
+        text_query = bool(query_lower) or not tags_filter
+        title_match = text_query and query_lower in channel_info["title"].lower()
+        desc_match = text_query and query_lower in channel_info["description"].lower()
+        id_match = text_query and query_lower in channel_id.lower()
+        tags_match = False
+        
+        if tags_filter:
+            tags_match = any(tag.lower() in [t.lower() for t in channel_info["tags"]] for tag in tags_filter)
+        
+        if title_match or desc_match or id_match or (tags_filter and tags_match):
+            results.append({
+                "id": channel_id,
+                "title": channel_info["title"],
+                "description": channel_info["description"],
+                "tags": channel_info["tags"],
+                "creator": channel_info["creator"],
+                "member_count": len(channel_members.get(channel_id, ()))
+            })
+    
+    return results
+
+def add_channel_message(channel_id, username, message, ip_address, reply_to_id=None):
+    """Add a message to a channel"""
+    if channel_id not in channels_data:
+        return None
+    
+    channel = channels_data[channel_id]
+    msg_id = id_allocator.next_id(channel_stream(channel_id))
+    msg = {
+        "id": msg_id,
+        "username": username,
+        "message": message,
+        "timestamp": datetime.now().isoformat(),
+        "reply_to_id": reply_to_id,
+        "ip_address": ip_address,
+        "edited": False
+    }
+    if reply_to_id:
+        msg.update(get_reply_preview(channel_stream(channel_id), reply_to_id))
+    
+    channel["messages"].append(msg)
+    activity.record(ip_address, username, channel_id)
+    if len(channel["messages"]) > CHANNEL_RECENT_LIMIT + CHANNEL_ARCHIVE_BATCH:
+        archive_old_channel_messages(channel_id)
+    save_channels()
+    after_indexes_ready(history_index.add, channel_stream(channel_id), msg)
+    return msg
+
+def build_channel_members():
+    """Build the channel -> members reverse index from the user registry"""
+    channel_members.clear()
+    for ip, usernames_dict in users_data.items():
+        for username, user_data in usernames_dict.items():
+            channels_info = user_data.get("Channels", {})
+            for channel_id in channels_info.get("created", set()) | channels_info.get("joined", set()):
+                if channel_id in channels_data:
+                    channel_members.setdefault(channel_id, set()).add((ip, username))
+
+
+# ============================================================================
+# HISTORY INDEX FEATURE
+# ============================================================================
+
+# Secondary indexes over global chat and channel messages for moderation
+# lookups. Every message gets a document number in indexing order; username,
+# IP, stream and hourly timestamp buckets each map to a list of those numbers
+# kept in (timestamp, doc number) order, so results come back newest first
+# whichever stream they are from. The index is rebuilt at startup from an
+# append-only log holding only the indexed fields, never the message text.
+#
+# The same index records reply threads: each document keeps its parent id and
+# (stream, parent id) maps to the documents replying to it, so a whole
+# conversation tree is found without scanning any messages. Reply previews
+# (parent username and text) are copied into a reply when it is written.
+HISTORY_INDEX_FILE = "features/history_index.log"
+HISTORY_BUCKET_SECONDS = 3600
+HISTORY_PAGE_SIZE = 50
+THREAD_MESSAGE_LIMIT = 500  # messages returned by one load_thread
+REPLY_PREVIEW_LENGTH = 100  # characters of the parent kept in a reply
+
+
+def to_epoch_seconds(timestamp):
+    """Convert a datetime or ISO timestamp string to integer epoch seconds"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return int(timestamp.timestamp())
+
+
+def parse_time_filter(value):
+    """Accept epoch seconds (a number or numeric string) or an ISO timestamp for
+    history and export bounds; raises ValueError for anything else"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str) and re.fullmatch(r"\s*-?\d+(\.\d+)?\s*", value):
+        value = float(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value):
+            raise ValueError(f"not a finite time: {value}")
+        return int(value)
+    if not isinstance(value, str):
+        raise ValueError(f"not a time: {value!r}")
+    return to_epoch_seconds(value)
+
+
+class HistoryIndex:
+    """Username, IP, stream and time-bucket indexes over all stored messages"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.doc_streams = []  # doc number -> stream
+        self.doc_ids = array("q")  # doc number -> message id within its stream
+        self.doc_times = array("q")  # doc number -> epoch seconds
+        self.by_username = {}
+        self.by_ip = {}
+        self.by_stream = {}
+        self.by_bucket = {}
+        self.bucket_keys = []  # hours present in by_bucket, ascending
+        self.doc_parents = array("q")  # doc number -> id of the message it replies to, 0 if none
+        self.by_parent = {}  # {(stream, parent id): doc numbers of its replies}
+        self.stream_ids = {}  # {stream: indexed message ids, ascending}
+        self.stream_docs = {}  # {stream: doc numbers, parallel to stream_ids}
+        self.dropped_streams = set()  # deleted channels; their docs stay in the lists but never match
+        self._log = None
+
+    def load(self):
+        """Rebuild the in-memory indexes from the log"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f, self.lock:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # an entry torn by a crash mid-write
+                if len(entry) < 6:
+                    break  # written before reply parents were logged
+                if self._find_doc(entry[0], entry[1]) is None:
+                    self._index(*entry)
+            else:
+                return
+        # Rebuild from the messages
+        self.__init__(self.path)
+        os.remove(self.path)
+
+    def add(self, stream, msg):
+        """Index a new message and append it to the log"""
+        entry = [stream, msg["id"], msg["username"], msg.get("ip_address"), to_epoch_seconds(msg["timestamp"]),
+                 msg.get("reply_to_id") or 0]
+        with self.lock:
+            # Ids are allocated before the message reaches the index, so they may arrive out of order
+            if stream in self.dropped_streams or self._find_doc(stream, msg["id"]) is not None:
+                return
+            if self._log is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._log = open(self.path, "a", encoding="utf-8")
+            self._log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._log.flush()
+            self._index(*entry)
+
+    def drop_stream(self, stream):
+        """Stop returning a deleted channel's messages. The log keeps them, so
+        load_history_index drops the stream again after a restart."""
+        with self.lock:
+            self.dropped_streams.add(stream)
+            self.by_stream.pop(stream, None)
+            self.stream_ids.pop(stream, None)
+            self.stream_docs.pop(stream, None)
+
+    def newest_id(self, stream):
+        """Highest message id indexed for a stream, 0 if none"""
+        with self.lock:
+            ids = self.stream_ids.get(stream)
+            return ids[-1] if ids else 0
+
+    def query(self, username=None, ip_address=None, stream=None, since=None, until=None,
+              before=None, limit=HISTORY_PAGE_SIZE):
+        """Return ([(stream, message id, doc number)], next cursor), newest first.
+
+        Every doc list is kept in (timestamp, doc number) order, so the time
+        range and the page cursor are binary searches. The list with the fewest
+        docs in range drives the scan from its newest end and the others are
+        probed by binary search; the scan stops once the page is full, so a
+        page costs O(page size * log n) when the filters are selective.
+        """
+        with self.lock:
+            lower = (since, -1) if since is not None else None
+            upper = (until, -1) if until is not None else None
+            if isinstance(before, int) and 0 <= before < len(self.doc_ids):
+                cursor = self._sort_key(before)
+                upper = cursor if upper is None else min(upper, cursor)
+            
+            ranges = []  # (docs in range, doc list, start, end)
+            for index, key in ((self.by_username, username), (self.by_ip, ip_address), (self.by_stream, stream)):
+                if key is not None:
+                    docs = index.get(key, ())
+                    start, end = self._range(docs, lower, upper)
+                    ranges.append((end - start, docs, start, end))
+            ranges.sort(key=lambda item: item[0])
+            
+            if not ranges or (lower or upper) and self._bucket_count(lower, upper) < ranges[0][0]:
+                driver = self._iter_buckets(lower, upper)
+                others = [docs for _, docs, _, _ in ranges]
+            else:
+                _, docs, start, end = ranges[0]
+                driver = (docs[position] for position in range(end - 1, start - 1, -1))
+                others = [docs for _, docs, _, _ in ranges[1:]]
+            if self.dropped_streams:
+                driver = (doc for doc in driver if self.doc_streams[doc] not in self.dropped_streams)
+            
+            results = []
+            for doc in driver:
+                if all(self._contains(other, doc) for other in others):
+                    results.append((self.doc_streams[doc], self.doc_ids[doc], doc))
+                    if len(results) == limit:
+                        break
+            more = len(results) == limit and next(driver, None) is not None
+            return results, results[-1][2] if more else None
+
+    def _sort_key(self, doc):
+        return (self.doc_times[doc], doc)
+
+    def _range(self, docs, lower, upper):
+        """Positions [start, end) of the docs with lower <= (time, doc) < upper"""
+        start = bisect.bisect_left(docs, lower, key=self._sort_key) if lower is not None else 0
+        end = bisect.bisect_left(docs, upper, key=self._sort_key) if upper is not None else len(docs)
+        return start, end
+
+    def _contains(self, docs, doc):
+        """Check membership in a (timestamp, doc number) ordered list by binary search"""
+        position = bisect.bisect_left(docs, self._sort_key(doc), key=self._sort_key)
+        return position < len(docs) and docs[position] == doc
+
+    def _bucket_span(self, lower, upper):
+        """Positions [first, last) in bucket_keys of the hours overlapping the range"""
+        first = bisect.bisect_left(self.bucket_keys, lower[0] // HISTORY_BUCKET_SECONDS) if lower else 0
+        last = bisect.bisect_right(self.bucket_keys, upper[0] // HISTORY_BUCKET_SECONDS) if upper else len(self.bucket_keys)
+        return first, last
+
+    def _bucket_count(self, lower, upper):
+        """Docs in the hourly buckets overlapping the range (an upper bound on docs in range)"""
+        first, last = self._bucket_span(lower, upper)
+        return sum(len(self.by_bucket[bucket]) for bucket in self.bucket_keys[first:last])
+
+    def _iter_buckets(self, lower, upper):
+        """Docs in range newest first, walking the hourly buckets down from the newest"""
+        first, last = self._bucket_span(lower, upper)
+        for position in range(last - 1, first - 1, -1):
+            docs = self.by_bucket[self.bucket_keys[position]]
+            start, end = self._range(docs, lower, upper)
+            for doc_position in range(end - 1, start - 1, -1):
+                yield docs[doc_position]
+
+    def thread(self, stream, msg_id, limit=THREAD_MESSAGE_LIMIT):
+        """Return (root id, [(message id, parent id)] root first, truncated) for the
+        conversation containing a message, or None if it is not indexed"""
+        with self.lock:
+            doc = self._find_doc(stream, msg_id)
+            if doc is None:
+                return None
+            # Parents always have smaller ids, so this walk terminates
+            while self.doc_parents[doc]:
+                parent = self._find_doc(stream, self.doc_parents[doc])
+                if parent is None:
+                    break
+                doc = parent
+            
+            root_id = self.doc_ids[doc]
+            entries = []
+            pending = deque([doc])
+            while pending and len(entries) < limit:
+                doc = pending.popleft()
+                msg_id = self.doc_ids[doc]
+                entries.append((msg_id, self.doc_parents[doc] if msg_id != root_id else 0))
+                pending.extend(self.by_parent.get((stream, msg_id), ()))
+            return root_id, entries, bool(pending)
+
+    def _find_doc(self, stream, msg_id):
+        """Doc number of a message, or None if it is not indexed"""
+        ids = self.stream_ids.get(stream, ())
+        position = bisect.bisect_left(ids, msg_id)
+        if position < len(ids) and ids[position] == msg_id:
+            return self.stream_docs[stream][position]
+        return None
+
+    def _insert(self, docs, doc):
+        """Add a doc to a list kept in (timestamp, doc number) order"""
+        if not docs or self._sort_key(docs[-1]) < self._sort_key(doc):
+            docs.append(doc)
+        else:
+            bisect.insort(docs, doc, key=self._sort_key)  # an older message indexed late
+
+    def _index(self, stream, msg_id, username, ip_address, epoch, parent_id=0):
+        doc = len(self.doc_ids)
+        self.doc_streams.append(stream)
+        self.doc_ids.append(msg_id)
+        self.doc_times.append(epoch)
+        self._insert(self.by_username.setdefault(username, array("q")), doc)
+        if ip_address:
+            self._insert(self.by_ip.setdefault(ip_address, array("q")), doc)
+        self._insert(self.by_stream.setdefault(stream, array("q")), doc)
+        bucket = epoch // HISTORY_BUCKET_SECONDS
+        if bucket not in self.by_bucket:
+            self.by_bucket[bucket] = array("q")
+            bisect.insort(self.bucket_keys, bucket)
+        self._insert(self.by_bucket[bucket], doc)
+        parent_id = parent_id if isinstance(parent_id, int) and 0 < parent_id < msg_id else 0
+        self.doc_parents.append(parent_id)
+        if parent_id:
+            self.by_parent.setdefault((stream, parent_id), array("q")).append(doc)
+        ids = self.stream_ids.setdefault(stream, array("q"))
+        position = bisect.bisect_left(ids, msg_id)
+        ids.insert(position, msg_id)
+        self.stream_docs.setdefault(stream, array("q")).insert(position, doc)
+
+    def close(self):
+        with self.lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+def index_missing_history():
+    """Index chat and channel messages stored since the history log was last written"""
+    if not os.path.exists(HISTORY_INDEX_FILE):
+        # Built from scratch: merge every stream by time so the doc lists are appended in order
+        streams = [zip(itertools.repeat(CHAT_STREAM), iter_chat_history())]
+        for channel_id in list(channels_data):
+            streams.append(zip(itertools.repeat(channel_stream(channel_id)), iter_channel_history(channel_id)))
+        for stream, msg in heapq.merge(*streams, key=lambda item: to_epoch_seconds(item[1]["timestamp"])):
+            history_index.add(stream, msg)
+        return
+    
+    if history_index.newest_id(CHAT_STREAM) < chat_newest_on_disk and os.path.exists(CHAT_FILE):
+        with open(CHAT_FILE, "r", encoding="utf-8") as f:
+            for msg_data in json.load(f):
+                history_index.add(CHAT_STREAM, msg_data)
+    # Snapshots: handlers keep appending, archiving and deleting channels while this runs
+    for msg in list(chat_messages):
+        history_index.add(CHAT_STREAM, msg)
+    for channel_id, channel in list(channels_data.items()):
+        for msg in list(channel["messages"]):
+            history_index.add(channel_stream(channel_id), msg)
+
+
+def get_stored_message(stream, msg_id):
+    """Fetch a message from any stream, wherever it is currently stored"""
+    if stream == CHAT_STREAM:
+        msg = get_message_by_id(msg_id)
+        if msg is not None:
+            msg = dict(msg, timestamp=msg["timestamp"].isoformat())
+            return msg
+        return search_index.get_doc(msg_id)
+    channel_id = stream.split(":", 1)[1]
+    return get_channel_message(channel_id, msg_id)
+
+
+def get_reply_preview(stream, parent_id):
+    """Parent username and text to store in a reply, or {} if the parent is gone"""
+    parent = get_stored_message(stream, parent_id) if isinstance(parent_id, int) else None
+    if parent is None:
+        return {}
+    return {
+        "reply_to_username": parent["username"],
+        "reply_to_message": parent["message"][:REPLY_PREVIEW_LENGTH]
+    }
+
+
+def load_thread(stream, msg_id):
+    """Every message of the conversation containing msg_id, root first"""
+    found = history_index.thread(stream, msg_id)
+    if found is None:
+        return None
+    root_id, entries, truncated = found
+    messages = []
+    for entry_id, parent_id in entries:
+        msg = get_stored_message(stream, entry_id) or {"id": entry_id, "deleted": True}
+        msg = {key: value for key, value in msg.items() if key != "read_users"}
+        msg["reply_to_id"] = parent_id or None
+        if "username" in msg:
+            msg["read_count"] = message_read_count(stream, msg)
+        messages.append(msg)
+    return {"root_id": root_id, "messages": messages, "truncated": truncated}
+
+
+history_index = HistoryIndex(HISTORY_INDEX_FILE)
+
+
+# ============================================================================
+# CHANNEL TAGS FEATURE
+# ============================================================================
+
+# Tag popularity lives in memory: a prefix trie answers autocomplete, and each
+# trie node caches its most used tags, so a lookup only walks the prefix.
+# Trending uses exponentially decayed counts. Ranking by log(trend) +
+# last_used / TAU does not change as time passes, and a tag's key only grows
+# when it is used, so a small top-K list can be maintained on each bump.
+# Changes are written back to channel_tags.json in batches.
+TAG_SUGGESTION_LIMIT = 8
+TAG_TRENDING_LIMIT = 10
+TAG_TREND_HALF_LIFE = 24 * 3600  # seconds
+TAG_TREND_TAU = TAG_TREND_HALF_LIFE / math.log(2)
+TAG_FLUSH_BATCH = 20  # tag uses buffered before writing to disk
+TAG_FLUSH_INTERVAL = 30  # seconds; pending uses are written on the next use after this
+
+
+class TagTrieNode:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.top = []  # most used tag keys under this prefix, best first
+
+
+class TagService:
+    """Autocomplete and trending tags over channel tag usage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tags = {}  # {tag_lower: {"name", "count", "trend", "last_used"}}
+        self.root = TagTrieNode()
+        self.trending = []  # top tag keys by decayed count, best first
+        self.pending_changes = 0
+        self.last_flush = time.time()
+
+    def load(self):
+        for key, info in load_channel_tags().items():
+            self.tags[key] = {
+                "name": info.get("name", key),
+                "count": info.get("count", 0),
+                "trend": info.get("trend", info.get("count", 0)),
+                "last_used": info.get("last_used", 0)
+            }
+            self._update_trie(key)
+            self._update_trending(key)
+
+    def record(self, tags):
+        """Count one use of each tag"""
+        now = time.time()
+        with self.lock:
+            for tag in tags:
+                key = tag.lower()
+                info = self.tags.setdefault(key, {"name": tag, "count": 0, "trend": 0.0, "last_used": now})
+                info["count"] += 1
+                info["trend"] = info["trend"] * math.exp((info["last_used"] - now) / TAG_TREND_TAU) + 1
+                info["last_used"] = now
+                self._update_trie(key)
+                self._update_trending(key)
+                self.pending_changes += 1
+            if self.pending_changes >= TAG_FLUSH_BATCH or now - self.last_flush >= TAG_FLUSH_INTERVAL:
+                self._flush()
+
+    def suggest(self, prefix, limit=TAG_SUGGESTION_LIMIT):
+        """Most used tags starting with prefix"""
+        with self.lock:
+            node = self.root
+            for char in prefix.lower():
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            return [self._describe(key) for key in node.top[:limit]]
+
+    def top_trending(self, limit=TAG_TRENDING_LIMIT):
+        """Tags with the highest decayed usage right now"""
+        now = time.time()
+        with self.lock:
+            results = []
+            for key in self.trending[:limit]:
+                info = self._describe(key)
+                decay = math.exp((self.tags[key]["last_used"] - now) / TAG_TREND_TAU)
+                info["score"] = round(self.tags[key]["trend"] * decay, 3)
+                results.append(info)
+            return results
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pending_changes:
+            save_channel_tags(self.tags)
+            self.pending_changes = 0
+        self.last_flush = time.time()
+
+    def _describe(self, key):
+        return {"name": self.tags[key]["name"], "count": self.tags[key]["count"]}
+
+    def _trend_key(self, key):
+        info = self.tags[key]
+        return math.log(max(info["trend"], 1e-9)) + info["last_used"] / TAG_TREND_TAU
+
+    def _update_trie(self, key):
+        rank = lambda tag_key: (self.tags[tag_key]["count"], tag_key)
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, TagTrieNode())
+            self._insert_ranked(node.top, key, rank, TAG_SUGGESTION_LIMIT)
+
+    def _update_trending(self, key):
+        self._insert_ranked(self.trending, key, self._trend_key, TAG_TRENDING_LIMIT)
+
+    @staticmethod
+    def _insert_ranked(top, key, rank, limit):
+        """Keep `top` as the best `limit` keys; valid because ranks never decrease"""
+        if key not in top:
+            if len(top) >= limit and rank(key) <= rank(top[-1]):
+                return
+            top.append(key)
+        top.sort(key=rank, reverse=True)
+        del top[limit:]
+
+
+tag_service = TagService()
+
+
+# ============================================================================
+# HISTORY EXPORT FEATURE
+# ============================================================================
+
+# Exports stream chat and channel history one message at a time. chat.json is
+# read with an incremental JSON array parser and channel archives one segment
+# at a time, so memory use does not depend on how much history there is.
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_SCOPES = ("all", "chat", "channels")
+EXPORT_FIELDS = ["stream", "channel_id", "id", "username", "message", "timestamp", "reply_to_id", "ip_address", "edited"]
+EXPORT_READ_SIZE = 64 * 1024  # bytes read from disk at a time
+EXPORT_CHUNK_SIZE = 64 * 1024  # bytes collected before a chunk is sent
+
+
+def iter_json_array(path):
+    """Yield the elements of a top-level JSON array file without loading it whole"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        started = False
+        while True:
+            chunk = f.read(EXPORT_READ_SIZE)
+            buffer += chunk
+            position = 0
+            while True:
+                # Skip whitespace, the opening bracket and separating commas
+                while position < len(buffer) and (buffer[position].isspace() or buffer[position] in ",["):
+                    if buffer[position] == "[":
+                        started = True
+                    position += 1
+                if position >= len(buffer) or buffer[position] == "]":
+                    break
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break  # element continues in the next chunk
+                yield item
+                position = end
+            buffer = buffer[position:]
+            if not chunk or (started and buffer.startswith("]")):
+                return
+
+
+def iter_chat_history():
+    """Yield every global chat message, oldest first: disk first, then RAM"""
+    newest_on_disk = 0
+    if os.path.exists(CHAT_FILE):
+        for msg_data in iter_json_array(CHAT_FILE):
+            newest_on_disk = msg_data["id"]
+            yield msg_data
+    for msg in list(chat_messages):
+        if msg["id"] > newest_on_disk:
+            yield dict(msg, timestamp=msg["timestamp"].isoformat())
+
+
+def iter_channel_history(channel_id):
+    """Yield every message of a channel, oldest first: archive segments, then RAM"""
+    channel = channels_data.get(channel_id)
+    if channel is None:
+        return
+    recent = list(channel["messages"])
+    archive_dir = os.path.join(CHANNEL_ARCHIVE_DIR, channel_id)
+    if os.path.isdir(archive_dir):
+        segments = sorted(int(name.split(".")[0]) for name in os.listdir(archive_dir) if name.endswith(".json"))
+        for segment in segments:
+            # Read directly rather than through the segment cache to avoid evicting hot pages
+            with open(get_archive_segment_path(channel_id, segment), "r", encoding="utf-8") as f:
+                for msg in json.load(f):
+                    if not recent or msg["id"] < recent[0]["id"]:
+                        yield msg
+    yield from recent
+
+
+def iter_export_records(scope="all", channel_id=None, username=None, since=None, until=None):
+    """Yield flat export records matching the filters (since/until in epoch seconds)"""
+    def matches(msg):
+        if username is not None and msg["username"] != username:
+            return False
+        if since is not None or until is not None:
+            epoch = to_epoch_seconds(msg["timestamp"])
+            if since is not None and epoch < since:
+                return False
+            if until is not None and epoch >= until:
+                return False
+        return True
+    
+    def record(stream, stream_channel_id, msg):
+        return {
+            "stream": stream,
+            "channel_id": stream_channel_id,
+            "id": msg["id"],
+            "username": msg["username"],
+            "message": msg["message"],
+            "timestamp": msg["timestamp"],
+            "reply_to_id": msg.get("reply_to_id"),
+            "ip_address": msg.get("ip_address"),
+            "edited": msg.get("edited", False)
+        }
+    
+    if scope in ("all", "chat") and channel_id is None:
+        for msg in iter_chat_history():
+            if matches(msg):
+                yield record(CHAT_STREAM, None, msg)
+    if scope in ("all", "channels"):
+        channel_ids = [channel_id] if channel_id is not None else sorted(channels_data, key=channel_id_sort_key)
+        for export_channel_id in channel_ids:
+            for msg in iter_channel_history(export_channel_id):
+                if matches(msg):
+                    yield record("channel", export_channel_id, msg)
+
+
+def iter_export_lines(records, export_format):
+    """Serialize export records as NDJSON or CSV text lines"""
+    if export_format == "ndjson":
+        for item in records:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for item in records:
+        writer.writerow(item)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_export_chunks(lines, compress=False):
+    """Group text lines into byte chunks, optionally gzip-compressed on the fly"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip container
+    pending = []
+    pending_size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= EXPORT_CHUNK_SIZE:
+            yield b"".join(pending)
+            pending, pending_size = [], 0
+    if compressor:
+        pending.append(compressor.flush())
+    if pending:
+        yield b"".join(pending)
+
+
+def export_history(export_format="ndjson", compress=False, **filters):
+    """Generate the bytes of a history export"""
+    return iter_export_chunks(iter_export_lines(iter_export_records(**filters), export_format), compress)
+
+
+def run_export_cli(argv):
+    """Command line entry point: python app.py export [options]"""
+    parser = argparse.ArgumentParser(prog="app.py export", description="Stream chat and channel history")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--scope", choices=EXPORT_SCOPES, default="all")
+    parser.add_argument("--channel", help="only export this channel id")
+    parser.add_argument("--user", help="only export messages from this username")
+    parser.add_argument("--since", help="ISO timestamp or epoch seconds (inclusive)")
+    parser.add_argument("--until", help="ISO timestamp or epoch seconds (exclusive)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+    try:
+        since = parse_time_filter(args.since)
+        until = parse_time_filter(args.until)
+    except ValueError:
+        parser.error("--since and --until take an ISO timestamp or epoch seconds")
+    # Read-only: the server may be running against the same files
+    load_channels(read_only=True)
+    
+    chunks = export_history(
+        args.format,
+        compress=args.gzip,
+        scope="channels" if args.channel else args.scope,
+        channel_id=args.channel,
+        username=args.user,
+        since=since,
+        until=until
+    )
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+# ============================================================================
+# READ CURSORS FEATURE
+# ============================================================================
+
+# Read state is one last-read message id per user per stream ("chat" or
+# "channel:<id>"): everything up to the cursor counts as read. Each stream
+# also keeps its cursor values sorted, so a message's read count is a binary
+# search. Cursors are written to disk in batches.
+READ_CURSORS_FILE = "features/read_cursors.json"
+READ_CURSOR_FLUSH_BATCH = 50  # cursor moves buffered before writing to disk
+READ_CURSOR_FLUSH_INTERVAL = 30  # seconds; pending moves are written on the next move after this
+
+
+class ReadCursorService:
+    """Last-read message id per user per stream"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cursors = {}  # {stream: {username: last read id}}
+        self.sorted_cursors = {}  # {stream: sorted cursor values}
+        self.pending_changes = 0
+        self.last_flush = time.time()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self.lock:
+                for stream, users in data.items():
+                    self.cursors[stream] = users
+                    self.sorted_cursors[stream] = sorted(users.values())
+
+    def get(self, stream, username, default=0):
+        with self.lock:
+            return self.cursors.get(stream, {}).get(username, default)
+
+    def advance(self, stream, username, msg_id):
+        """Move a user's cursor forward; returns the previous position, or None if it did not move"""
+        with self.lock:
+            previous = self._move(stream, username, msg_id)
+            if previous is None:
+                return None
+            if self.pending_changes >= READ_CURSOR_FLUSH_BATCH or time.time() - self.last_flush >= READ_CURSOR_FLUSH_INTERVAL:
+                self._flush()
+            return previous
+
+    def seed(self, stream, username, msg_id):
+        """Move a cursor forward while loading older data; written by the next flush"""
+        with self.lock:
+            self._move(stream, username, msg_id)
+
+    def _move(self, stream, username, msg_id):
+        users = self.cursors.setdefault(stream, {})
+        values = self.sorted_cursors.setdefault(stream, [])
+        previous = users.get(username)
+        if previous is not None:
+            if msg_id <= previous:
+                return None
+            del values[bisect.bisect_left(values, previous)]
+        users[username] = msg_id
+        bisect.insort(values, msg_id)
+        self.pending_changes += 1
+        return previous or 0
+
+    def read_count(self, stream, msg_id, author=None):
+        """Number of users whose cursor is at or past a message, not counting its author"""
+        with self.lock:
+            values = self.sorted_cursors.get(stream, ())
+            count = len(values) - bisect.bisect_left(values, msg_id)
+            if author is not None and self.cursors.get(stream, {}).get(author, 0) >= msg_id:
+                count -= 1
+            return count
+
+    def drop(self, stream):
+        """Forget the cursors of a deleted stream"""
+        with self.lock:
+            if self.cursors.pop(stream, None) is not None:
+                self.sorted_cursors.pop(stream, None)
+                self.pending_changes += 1
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending_changes:
+            return
+        write_json_atomic(self.path, self.cursors, ensure_ascii=False, separators=(",", ":"))
+        self.pending_changes = 0
+        self.last_flush = time.time()
+
+
+def message_read_count(stream, msg):
+    """Readers of a message: its cursor-derived count, or the count stored with it
+    before read cursors existed if that is higher"""
+    return max(msg.get("read_count", 0), read_cursors.read_count(stream, msg["id"], msg["username"]))
+
+
+def channel_unread_count(channel_id, username):
+    """Return (unread messages, capped) for a user in a channel.
+
+    Only the hot window is counted; capped is True when the cursor is older
+    than the window and archived messages may be unread too.
+    """
+    messages = channels_data[channel_id]["messages"]
+    cursor = read_cursors.get(channel_stream(channel_id), username, None)
+    if cursor is None:
+        # A member from before read cursors existed starts out caught up
+        cursor = messages[-1]["id"] if messages else 0
+        read_cursors.advance(channel_stream(channel_id), username, cursor)
+    position = bisect.bisect_right(messages, cursor, key=lambda msg: msg["id"])
+    capped = position == 0 and len(messages) >= CHANNEL_RECENT_LIMIT and messages[0]["id"] > cursor + 1
+    return len(messages) - position, capped
+
+
+read_cursors = ReadCursorService(READ_CURSORS_FILE)
+
+
+# ============================================================================
+# ACTIVITY STATS FEATURE
+# ============================================================================
+
+# Running message counters per user (kept in the user's "Chat" record in
+# users.json) and per channel (an "activity" record in channels.json), each
+# with a histogram of messages per hour over the last ACTIVITY_WINDOW_HOURS.
+# Every message updates them in O(1); user records are written back in
+# batches, channel records go out with the next save_channels.
+ACTIVITY_WINDOW_HOURS = 24
+ACTIVITY_LEADERBOARD_SIZE = 10
+ACTIVITY_FLUSH_BATCH = 50  # messages counted before users.json is rewritten
+ACTIVITY_FLUSH_INTERVAL = 30  # seconds; pending counts are written on the next message after this
+
+
+def current_hour():
+    """Epoch seconds at the start of the current hour"""
+    now = int(time.time())
+    return now - now % 3600
+
+
+def bump_activity(stats, hour, now):
+    """Count one message in an activity record: {"messages", "last_active", "hourly"}"""
+    stats["messages"] = stats.get("messages", 0) + 1
+    stats["last_active"] = now
+    hourly = stats.setdefault("hourly", {})
+    key = str(hour)
+    if key not in hourly:
+        # A new hour started: drop buckets that left the window
+        oldest = hour - (ACTIVITY_WINDOW_HOURS - 1) * 3600
+        for stale in [bucket for bucket in hourly if int(bucket) < oldest]:
+            del hourly[stale]
+    hourly[key] = hourly.get(key, 0) + 1
+
+
+def copy_activity(stats):
+    """Copy of an activity record that shares no dicts with the original"""
+    return dict(stats, hourly=dict(stats.get("hourly", {})))
+
+
+def messages_in_last_hour(stats, hour):
+    """Messages in the current and previous hourly buckets"""
+    hourly = stats.get("hourly", {})
+    return hourly.get(str(hour), 0) + hourly.get(str(hour - 3600), 0)
+
+
+class ActivityService:
+    """Per-user and per-channel message counters and hourly histograms"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}  # {(ip, username): activity record}
+        self.totals = {}  # activity record over every message
+        self.dirty = set()  # (ip, username) changed since the last flush
+        self.pending_changes = 0
+        self.last_flush = time.time()
+
+    def load(self):
+        with self.lock:
+            totals_hourly = self.totals.setdefault("hourly", {})
+            for ip, usernames_dict in users_data.items():
+                for username, user_data in usernames_dict.items():
+                    stats = copy_activity(user_data.get("Chat") or {})
+                    self.users[(ip, username)] = stats
+                    for bucket, count in stats.get("hourly", {}).items():
+                        totals_hourly[bucket] = totals_hourly.get(bucket, 0) + count
+
+    def record(self, ip_address, username, channel_id=None):
+        """Count a message by a user, in global chat or a channel"""
+        now = int(time.time())
+        hour = now - now % 3600
+        with self.lock:
+            stats = self.users.setdefault((ip_address, username), {})
+            bump_activity(stats, hour, now)
+            field = "channel_messages" if channel_id else "chat_messages"
+            stats[field] = stats.get(field, 0) + 1
+            bump_activity(self.totals, hour, now)
+            if channel_id:
+                bump_activity(channels_data[channel_id].setdefault("activity", {}), hour, now)
+            self.dirty.add((ip_address, username))
+            self.pending_changes += 1
+            if self.pending_changes >= ACTIVITY_FLUSH_BATCH or now - self.last_flush >= ACTIVITY_FLUSH_INTERVAL:
+                self._flush()
+
+    def summary(self, limit=ACTIVITY_LEADERBOARD_SIZE):
+        """Leaderboards, active user count and the hourly histogram"""
+        hour = current_hour()
+        active_since = int(time.time()) - 3600
+        with self.lock:
+            users = list(self.users.items())
+            top_users = heapq.nlargest(limit, users, key=lambda item: item[1].get("messages", 0))
+            hourly = dict(self.totals.get("hourly", {}))
+        channels = [(channel_id, channel.get("activity", {})) for channel_id, channel in list(channels_data.items())]
+        top_channels = heapq.nlargest(limit, channels, key=lambda item: (messages_in_last_hour(item[1], hour), item[1].get("messages", 0)))
+        return {
+            "active_users_last_hour": sum(1 for _, stats in users if stats.get("last_active", 0) >= active_since),
+            "top_users": [{
+                "username": username,
+                "messages": stats.get("messages", 0),
+                "chat_messages": stats.get("chat_messages", 0),
+                "channel_messages": stats.get("channel_messages", 0),
+                "last_hour": messages_in_last_hour(stats, hour)
+            } for (_, username), stats in top_users if stats.get("messages")],
+            "top_channels": [{
+                "id": channel_id,
+                "title": channels_data[channel_id]["title"] if channel_id in channels_data else channel_id,
+                "messages": stats.get("messages", 0),
+                "last_hour": messages_in_last_hour(stats, hour)
+            } for channel_id, stats in top_channels if stats.get("messages")],
+            "hourly": [
+                {"hour": bucket, "count": hourly.get(str(bucket), 0)}
+                for bucket in range(hour - (ACTIVITY_WINDOW_HOURS - 1) * 3600, hour + 1, 3600)
+            ]
+        }
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.dirty:
+            return
+        with users_lock:
+            for ip, username in self.dirty:
+                user_data = users_data.get(ip, {}).get(username)
+                if user_data is not None:
+                    # A copy: record() keeps changing ours outside users_lock while the journal is written
+                    user_data["Chat"] = copy_activity(self.users[(ip, username)])
+            persist_users(*self.dirty)
+        self.dirty.clear()
+        self.pending_changes = 0
+        self.last_flush = time.time()
+
+
+activity = ActivityService()
+
+
+# ============================================================================
+# RECONNECT / REPLAY FEATURE
+# ============================================================================
+
+# Every broadcast that changes a stream ("chat", "channels" or "channel:<id>")
+# is stamped with the global sequence number and kept in a short per-stream
+# buffer, so a reconnecting client can ask for just the events it missed.
+REPLAY_BUFFER_LIMIT = 500  # events kept per stream
+REPLAY_EPOCH = datetime.now().isoformat()  # changes on restart, invalidating old cursors
+replay_buffers = {}  # {stream: deque of (seq, event, payload)}
+replay_evicted_seq = {}  # {stream: seq of the newest event dropped from the buffer}
+replay_lock = threading.Lock()
+
+
+def get_stream_cursor(stream):
+    """Return the cursor a client should resume from after a full reload"""
+    with replay_lock:
+        return {"stream": stream, "seq": id_allocator.peek(GLOBAL_SEQUENCE) - 1, "epoch": REPLAY_EPOCH}
+
+
+def record_stream_event(stream, event, payload):
+    """Stamp a payload with the next global sequence number and buffer it for replay"""
+    with replay_lock:
+        seq = id_allocator.next_id(GLOBAL_SEQUENCE)
+        payload["seq"] = seq
+        buffer = replay_buffers.setdefault(stream, deque())
+        buffer.append((seq, event, payload))
+        if len(buffer) > REPLAY_BUFFER_LIMIT:
+            replay_evicted_seq[stream] = buffer.popleft()[0]
+    return payload
+
+
+def broadcast_stream_event(stream, event, payload):
+    """Record a stream event for replay and broadcast it to every client"""
+    broadcast_encoded(event, record_stream_event(stream, event, payload))
+
+
+def get_missed_events(stream, last_seq):
+    """Return the (event, payload) pairs after last_seq, or None if the cursor aged out"""
+    with replay_lock:
+        if last_seq >= id_allocator.peek(GLOBAL_SEQUENCE) or last_seq < replay_evicted_seq.get(stream, 0):
+            return None
+        buffer = replay_buffers.get(stream, ())
+        return [(event, payload) for seq, event, payload in buffer if seq > last_seq]
+
+
+def drop_stream(stream):
+    """Forget the replay buffer of a stream that no longer exists"""
+    with replay_lock:
+        replay_buffers.pop(stream, None)
+        replay_evicted_seq.pop(stream, None)
+
+
+# ============================================================================
+# WIRE FORMAT FEATURE
+# ============================================================================
+
+# Clients start on the verbose "json" format and may switch to "compact" with
+# the set_wire_format event. Compact messages use short keys and epoch-ms
+# timestamps; history pages are sent column-wise with repeated strings
+# (usernames, IPs) replaced by indexes into a per-batch dictionary.
+WIRE_FORMATS = ("json", "compact")
+client_wire_formats = {}  # {sid: format}
+
+COMPACT_MESSAGE_KEYS = {
+    "id": "i",
+    "channel_id": "c",
+    "username": "u",
+    "message": "m",
+    "timestamp": "t",
+    "read_count": "r",
+    "reply_to_id": "p",
+    "reply_to_username": "pu",
+    "reply_to_message": "pm",
+    "ip_address": "a",
+    "edited": "e",
+    "seq": "s"
+}
+COMPACT_CHANNEL_KEYS = {
+    "id": "i",
+    "title": "n",
+    "description": "d",
+    "tags": "g",
+    "creator": "u",
+    "member_count": "k"
+}
+DICTIONARY_FIELDS = {"username", "reply_to_username", "ip_address", "creator"}
+
+# event -> (layout, key map); events not listed are sent unchanged
+COMPACT_EVENTS = {
+    "chat_message": ("row", COMPACT_MESSAGE_KEYS),
+    "channel_message": ("row", COMPACT_MESSAGE_KEYS),
+    "older_messages": ("columns", COMPACT_MESSAGE_KEYS),
+    "channel_older_messages": ("columns", COMPACT_MESSAGE_KEYS),
+    "search_results": ("columns", COMPACT_CHANNEL_KEYS)
+}
+
+
+def to_epoch_ms(timestamp):
+    """Convert a datetime or ISO timestamp string to epoch milliseconds"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return int(timestamp.timestamp() * 1000)
+
+
+def compact_value(field, value):
+    """Shrink a single field value for the compact format"""
+    if field == "timestamp" and value:
+        return to_epoch_ms(value)
+    return value
+
+
+def encode_row(row, keys):
+    """Encode one object with short keys, dropping empty optional fields"""
+    encoded = {}
+    for field, key in keys.items():
+        value = row.get(field)
+        if value is None or value is False:
+            continue
+        encoded[key] = compact_value(field, value)
+    return encoded
+
+
+def encode_columns(rows, keys):
+    """Encode a list of objects as one array per field plus a string dictionary"""
+    strings = []
+    string_index = {}
+    columns = {}
+    present = [field for field in keys if any(row.get(field) is not None for row in rows)]
+
+    for field in present:
+        column = []
+        for row in rows:
+            value = row.get(field)
+            if field in DICTIONARY_FIELDS and value is not None:
+                if value not in string_index:
+                    string_index[value] = len(strings)
+                    strings.append(value)
+                value = string_index[value]
+            else:
+                value = compact_value(field, value)
+            column.append(value)
+        columns[keys[field]] = column
+
+    return {
+        "n": len(rows),
+        "d": strings,
+        "dk": [keys[field] for field in present if field in DICTIONARY_FIELDS],
+        "cols": columns
+    }
+
+
+def encode_payload(event, payload, wire_format):
+    """Encode an outgoing payload for a client's wire format"""
+    if wire_format != "compact" or event not in COMPACT_EVENTS:
+        return payload
+    layout, keys = COMPACT_EVENTS[event]
+    if layout == "row":
+        return encode_row(payload, keys)
+    return encode_columns(payload, keys)
+
+
+def get_wire_format(sid=None):
+    """Return the wire format negotiated by a client (the current one by default)"""
+    return client_wire_formats.get(sid or request.sid, "json")
+
+
+def emit_encoded(event, payload):
+    """Emit to the current client in its negotiated wire format"""
+    emit(event, encode_payload(event, payload, get_wire_format()))
+
+
+def broadcast_encoded(event, payload):
+    """Broadcast to every client through its outbound queue"""
+    fanout.publish(event, payload)
+
+
+# ============================================================================
+# FAN-OUT FEATURE
+# ============================================================================
+
+# Broadcasts are not written to clients directly. They are put on a bounded
+# per-client queue, and a dispatcher task moves frames to each client's
+# Engine.IO transport queue only while that queue is short. A slow client
+# therefore backs up in its own queue instead of growing an unbounded
+# transport buffer, and never delays frames for anyone else. Frames of some
+# events (read count updates) are merged into the previous frame when it is
+# the same event and still the last one queued, so a merged frame never
+# overtakes anything sent before it. A client whose queue overflows is
+# disconnected by default; it reconnects and resumes from its stream cursors
+# through the replay buffers. Under the "drop" policy the oldest frames are
+# discarded instead and the client is told how many it lost, so it can reload.
+OUTBOUND_QUEUE_LIMIT = 256  # frames waiting per client
+TRANSPORT_BACKLOG_LIMIT = 32  # packets allowed in a client's Engine.IO queue
+SLOW_CONSUMER_POLICY = "disconnect"  # or "drop" to discard the oldest queued frame
+FANOUT_IDLE_WAIT = 1  # seconds the dispatcher sleeps when nothing is queued
+FANOUT_RETRY_WAIT = 0.01  # seconds before retrying clients whose transport was full
+
+def merge_read_counts(queued, payload):
+    """Fold newer read counts into the queued update, taking the newer seq"""
+    return dict(payload, counts={**queued["counts"], **payload["counts"]})
+
+
+# event -> merge function; a newer frame is folded into the queue tail if it is the same event
+COALESCED_EVENTS = {
+    "update_read_counts": merge_read_counts
+}
+
+
+class ClientQueue:
+    """Frames waiting to be handed to one client's transport"""
+    
+    def __init__(self):
+        self.frames = deque()  # [event, payload, coalesce key, enqueued at]
+        self.overflowed = False
+        self.dropped = 0  # frames discarded since the client was last told
+
+
+class FanOut:
+    """Bounded per-client send queues drained by a dispatcher task"""
+    
+    def __init__(self, queue_limit=OUTBOUND_QUEUE_LIMIT, backlog_limit=TRANSPORT_BACKLOG_LIMIT,
+                 policy=SLOW_CONSUMER_POLICY):
+        self.queue_limit = queue_limit
+        self.backlog_limit = backlog_limit
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.clients = {}  # {sid: ClientQueue}
+        self.metrics = Counter()
+        self.task_started = False
+    
+    def register(self, sid):
+        with self.lock:
+            self.clients[sid] = ClientQueue()
+            if not self.task_started:
+                self.task_started = True
+                socketio.start_background_task(self._dispatch_loop)
+    
+    def unregister(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+    
+    def publish(self, event, payload, room=None):
+        """Queue an event for every client, or only those in a Socket.IO room"""
+        encoded = {}  # {wire format: payload}, encoded once per format
+        now = time.monotonic()
+        with self.lock:
+            if room is None:
+                sids = list(self.clients)
+            else:
+                sids = [sid for sid, _ in socketio.server.manager.get_participants("/", room)]
+            for sid in sids:
+                client = self.clients.get(sid)
+                if client is None or client.overflowed:
+                    continue
+                wire_format = get_wire_format(sid)
+                if wire_format not in encoded:
+                    encoded[wire_format] = encode_payload(event, payload, wire_format)
+                self._enqueue(client, event, encoded[wire_format], now)
+        self.wake.set()
+    
+    def send(self, sid, event, payload):
+        """Queue an event for one client, behind what is already queued for it.
+        
+        Not subject to the queue limit: callers send a bounded burst (e.g. a
+        resume replay) that must arrive whole and in order.
+        """
+        with self.lock:
+            client = self.clients.get(sid)
+            if client is None or client.overflowed:
+                return
+            self._enqueue(client, event, encode_payload(event, payload, get_wire_format(sid)), time.monotonic(),
+                          bounded=False)
+        self.wake.set()
+    
+    def _enqueue(self, client, event, payload, now, bounded=True):
+        key = None
+        if event in COALESCED_EVENTS:
+            key = event
+            # Only the tail: merging into an earlier frame would deliver these
+            # counts ahead of the messages queued after it
+            frame = client.frames[-1] if client.frames else None
+            if frame is not None and frame[2] == key:
+                frame[1] = COALESCED_EVENTS[event](frame[1], payload)
+                self.metrics["coalesced"] += 1
+                return
+        if bounded and len(client.frames) >= self.queue_limit:
+            self.metrics["overflows"] += 1
+            if self.policy != "drop":
+                client.overflowed = True
+                return
+            client.frames.popleft()
+            client.dropped += 1
+            self.metrics["dropped"] += 1
+        client.frames.append([event, payload, key, now])
+        self.metrics["enqueued"] += 1
+    
+    def transport_backlog(self, sid):
+        """Packets waiting in a client's Engine.IO queue"""
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, "/")
+        eio_socket = socketio.server.eio.sockets.get(eio_sid)
+        return eio_socket.queue.qsize() if eio_socket is not None else 0
+    
+    def _dispatch_loop(self):
+        pending = False
+        while True:
+            self.wake.wait(FANOUT_RETRY_WAIT if pending else FANOUT_IDLE_WAIT)
+            self.wake.clear()
+            pending = self.dispatch()
+    
+    def dispatch(self):
+        """Hand queued frames to every client with room in its transport queue.
+        
+        Returns True if some client still has frames waiting.
+        """
+        pending = False
+        with self.lock:
+            clients = list(self.clients.items())
+        for sid, client in clients:
+            if client.overflowed:
+                with self.lock:
+                    self.clients.pop(sid, None)
+                    self.metrics["slow_disconnects"] += 1
+                socketio.server.disconnect(sid, namespace="/")
+                continue
+            if not client.frames and not client.dropped:
+                continue
+            room = self.backlog_limit - self.transport_backlog(sid)
+            if room <= 0:
+                pending = True
+                continue
+            with self.lock:
+                dropped, client.dropped = client.dropped, 0
+                batch = []
+                while client.frames and len(batch) < room:
+                    batch.append(client.frames.popleft())
+                pending = pending or bool(client.frames)
+            if dropped:
+                # Sent ahead of the frames that survived, so the client reloads before applying them
+                print(f"Dropped {dropped} queued events for slow client {sid}")
+                socketio.emit("events_dropped", {"count": dropped}, to=sid)
+            now = time.monotonic()
+            for event, payload, _, enqueued_at in batch:
+                socketio.emit(event, payload, to=sid)
+            with self.lock:
+                self.metrics["sent"] += len(batch)
+                self.metrics["delay_ms"] += sum((now - frame[3]) * 1000 for frame in batch)
+        return pending
+    
+    def stats(self):
+        """Counters and current queue depths for the server stats page"""
+        with self.lock:
+            depths = [len(client.frames) for client in self.clients.values()]
+            metrics = dict(self.metrics)
+        sent = metrics.get("sent", 0)
+        return {
+            "clients": len(depths),
+            "queued": sum(depths),
+            "max_queue": max(depths, default=0),
+            "lagging": sum(1 for depth in depths if depth > self.backlog_limit),
+            "enqueued": metrics.get("enqueued", 0),
+            "sent": sent,
+            "coalesced": metrics.get("coalesced", 0),
+            "dropped": metrics.get("dropped", 0),
+            "overflows": metrics.get("overflows", 0),
+            "slow_disconnects": metrics.get("slow_disconnects", 0),
+            "avg_delay_ms": round(metrics.get("delay_ms", 0) / sent, 2) if sent else 0
+        }
+
+
+fanout = FanOut()
+
+
+# ============================================================================
+# PRESENCE FEATURE
+# ============================================================================
+
+PRESENCE_HEARTBEAT_TIMEOUT = 60  # seconds without a heartbeat before a session expires
+PRESENCE_GRACE_PERIOD = 10  # seconds a user may be gone before "left" is announced
+PRESENCE_FLUSH_INTERVAL = 2  # seconds between batched presence broadcasts
+
+
+class PresenceService:
+    """Tracks which users are online, globally and per channel being viewed.
+
+    Changes are collected as deltas and handed out in batches by drain().
+    A user whose last session drops is only reported offline after
+    PRESENCE_GRACE_PERIOD, so a client reconnecting on flaky Wi-Fi produces
+    no join/leave churn at all.
+    """
+
+    def __init__(self, heartbeat_timeout=PRESENCE_HEARTBEAT_TIMEOUT, grace_period=PRESENCE_GRACE_PERIOD):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.grace_period = grace_period
+        self._lock = threading.Lock()
+        self._sessions = {}  # {sid: {"username", "channel_id", "last_seen"}}
+        self._user_sessions = {}  # {username: set of sids}
+        self._channel_users = {}  # {channel_id: {username: open session count}}
+        self._online = set()
+        self._going_offline = {}  # {username: time the last session ended}
+        self._joined = set()
+        self._left = set()
+        self._channel_deltas = {}  # {channel_id: {"joined": set, "left": set}}
+
+    def connect(self, sid, username):
+        with self._lock:
+            self._sessions[sid] = {"username": username, "channel_id": None, "last_seen": time.monotonic()}
+            self._user_sessions.setdefault(username, set()).add(sid)
+            if self._going_offline.pop(username, None) is None and username not in self._online:
+                self._online.add(username)
+                if username in self._left:
+                    self._left.discard(username)  # went and came back within one batch
+                else:
+                    self._joined.add(username)
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._end_session(sid, time.monotonic())
+
+    def heartbeat(self, sid, username):
+        """Keep a session alive; returns True if it had expired and was registered again"""
+        with self._lock:
+            if sid in self._sessions:
+                self._sessions[sid]["last_seen"] = time.monotonic()
+                return False
+        # Heartbeats lapsed (e.g. timers throttled in a background tab) but the socket is still open
+        self.connect(sid, username)
+        return True
+
+    def set_channel(self, sid, channel_id):
+        """Record the channel a session is viewing; returns the previous one"""
+        with self._lock:
+            session_info = self._sessions.get(sid)
+            if session_info is None:
+                return None
+            previous = session_info["channel_id"]
+            if previous != channel_id:
+                self._leave_channel(session_info["username"], previous)
+                self._enter_channel(session_info["username"], channel_id)
+                session_info["channel_id"] = channel_id
+            return previous
+
+    def forget_channel(self, channel_id):
+        """Drop a deleted channel's online set"""
+        with self._lock:
+            self._channel_users.pop(channel_id, None)
+            self._channel_deltas.pop(channel_id, None)
+            for session_info in self._sessions.values():
+                if session_info["channel_id"] == channel_id:
+                    session_info["channel_id"] = None
+
+    def sweep(self):
+        """Expire silent sessions and users whose grace period ran out"""
+        now = time.monotonic()
+        with self._lock:
+            for sid, session_info in list(self._sessions.items()):
+                if now - session_info["last_seen"] > self.heartbeat_timeout:
+                    self._end_session(sid, now)
+            for username, since in list(self._going_offline.items()):
+                if now - since >= self.grace_period:
+                    del self._going_offline[username]
+                    self._online.discard(username)
+                    if username in self._joined:
+                        self._joined.discard(username)  # came and went within one batch
+                    else:
+                        self._left.add(username)
+
+    def drain(self):
+        """Return and reset the pending (joined, left, channel deltas)"""
+        with self._lock:
+            joined, left, channel_deltas = self._joined, self._left, self._channel_deltas
+            self._joined, self._left, self._channel_deltas = set(), set(), {}
+            return joined, left, channel_deltas
+
+    def online_users(self):
+        with self._lock:
+            return sorted(self._online)
+
+    def online_count(self):
+        return len(self._online)
+
+    def channel_online_users(self, channel_id):
+        with self._lock:
+            return sorted(self._channel_users.get(channel_id, {}))
+
+    def channel_online_count(self, channel_id):
+        return len(self._channel_users.get(channel_id, ()))
+
+    def _end_session(self, sid, now):
+        session_info = self._sessions.pop(sid, None)
+        if session_info is None:
+            return
+        username = session_info["username"]
+        self._leave_channel(username, session_info["channel_id"])
+        sids = self._user_sessions.get(username, set())
+        sids.discard(sid)
+        if not sids:
+            self._user_sessions.pop(username, None)
+            self._going_offline[username] = now
+
+    def _enter_channel(self, username, channel_id):
+        if channel_id is None:
+            return
+        users = self._channel_users.setdefault(channel_id, {})
+        users[username] = users.get(username, 0) + 1
+        if users[username] == 1:
+            self._channel_delta(channel_id, "joined", "left", username)
+
+    def _leave_channel(self, username, channel_id):
+        users = self._channel_users.get(channel_id)
+        if not users or username not in users:
+            return
+        users[username] -= 1
+        if users[username] == 0:
+            del users[username]
+            self._channel_delta(channel_id, "left", "joined", username)
+
+    def _channel_delta(self, channel_id, change, opposite, username):
+        delta = self._channel_deltas.setdefault(channel_id, {"joined": set(), "left": set()})
+        if username in delta[opposite]:
+            delta[opposite].discard(username)  # the two changes cancel out
+        else:
+            delta[change].add(username)
+
+
+presence = PresenceService()
+presence_task_started = False
+presence_task_lock = threading.Lock()
+
 
-def add_channel_message(channel_id, username, message, ip_address, reply_to_id=None):
-    """Add a message to a channel"""
-    if channel_id not in channels_data:
-        return None
-    
-    msg_id = len(channels_data[channel_id]["messages"]) + 1
-    msg = {
-        "id": msg_id,
-        "username": username,
-        "message": message,
-        "timestamp": datetime.now().isoformat(),
-        "read_count": 0,
-        "read_users": [],
-        "reply_to_id": reply_to_id,
-        "ip_address": ip_address,
-        "edited": False
-    }
+def channel_room(channel_id):
+    """Socket.IO room of the clients currently viewing a channel"""
+    return f"viewing:{channel_id}"
+
+
+def publish_presence_deltas():
+    """Broadcast one batch of presence changes"""
+    joined, left, channel_deltas = presence.drain()
+    if joined or left:
+        fanout.publish("presence_delta", {
+            "online": sorted(joined),
+            "offline": sorted(left),
+            "count": presence.online_count()
+        })
+        for username in sorted(joined):
+            fanout.publish("system_message", f"{username} connected.")
+        for username in sorted(left):
+            fanout.publish("system_message", f"{username} left.")
     
-    channels_data[channel_id]["messages"].append(msg)
-    save_channels()
-    return msg
+    for channel_id, delta in channel_deltas.items():
+        if delta["joined"] or delta["left"]:
+            fanout.publish("channel_presence_delta", {
+                "channel_id": channel_id,
+                "online": sorted(delta["joined"]),
+                "offline": sorted(delta["left"]),
+                "count": presence.channel_online_count(channel_id)
+            }, room=channel_room(channel_id))
 
-# Load channels on startup
-load_channels()
+
+def presence_loop():
+    """Background task: expire sessions and flush presence deltas periodically"""
+    while True:
+        socketio.sleep(PRESENCE_FLUSH_INTERVAL)
+        presence.sweep()
+        publish_presence_deltas()
+
+
+def ensure_presence_task():
+    """Start the presence background task the first time a client connects"""
+    global presence_task_started
+    with presence_task_lock:
+        if not presence_task_started:
+            presence_task_started = True
+            socketio.start_background_task(presence_loop)
 
 
 # ============================================================================
@@ -415,6 +2742,8 @@ STATS_UPDATE_INTERVAL = 3  # seconds
 
 def get_server_stats():
     """Gather current server statistics"""
+    import psutil  # only needed here, so not paid for at startup
+    
     # RAM Usage
     ram = psutil.virtual_memory()
     ram_percent = ram.percent
@@ -460,14 +2789,437 @@ def get_server_stats():
             "connections": net_connections,
             "active_interfaces": active_interfaces
         },
+        "outbound": fanout.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
 
 
+# ============================================================================
+# PROFILER FEATURE
+# ============================================================================
+
+# A thread-based stack sampler for diagnosing latency under real traffic.
+# Every interval it snapshots the stack of every thread via sys._current_frames
+# and counts identical stacks, tagged with the Socket.IO event (or "http")
+# the thread is handling. Output is collapsed stacks or a flamegraph SVG.
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+PROFILE_DEFAULT_INTERVAL_MS = 10
+PROFILE_MIN_INTERVAL_MS = 1
+PROFILE_FORMATS = ("collapsed", "svg")
+
+
+class StackSampler:
+    """Samples the stacks of all other threads until stopped"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.samples = Counter()
+        self.sample_count = 0
+        self.started_at = None
+    
+    @property
+    def running(self):
+        return self.thread is not None
+    
+    def start(self, interval=PROFILE_DEFAULT_INTERVAL_MS / 1000):
+        """Start sampling in a background thread, False if already running"""
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.samples = Counter()
+            self.sample_count = 0
+            self.started_at = time.monotonic()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, args=(interval,), name="stack-sampler", daemon=True)
+            self.thread.start()
+            return True
+    
+    def stop(self):
+        """Stop sampling and return (stack counts, samples taken, seconds elapsed)"""
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return None
+            self.stop_event.set()
+            thread.join()
+            self.thread = None
+            return self.samples, self.sample_count, time.monotonic() - self.started_at
+    
+    def _run(self, interval):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[self._collapse(frame)] += 1
+            self.sample_count += 1
+    
+    @staticmethod
+    def _collapse(frame):
+        """Render a frame chain as "tag;outer;...;inner" """
+        names = []
+        tag = "other"
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name == "_handle_event" and "flask_socketio" in code.co_filename:
+                tag = f"event:{frame.f_locals.get('message')}"
+            elif tag == "other" and code.co_name == "full_dispatch_request":
+                tag = "http"
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        names.append(tag)
+        return ";".join(reversed(names))
+
+
+def format_collapsed_stacks(samples):
+    """Brendan Gregg's collapsed format: one "a;b;c count" line per stack"""
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def render_flamegraph_svg(samples, title="Flame Graph"):
+    """Render collapsed stack counts as a standalone flamegraph SVG"""
+    # Merge stacks into a tree of {name: [count, children]}
+    root = [0, {}]
+    for stack, count in samples.items():
+        root[0] += count
+        node = root
+        for name in stack.split(";"):
+            node = node[1].setdefault(name, [0, {}])
+            node[0] += count
+    
+    width, row_height, top = 1200, 16, 40
+    total = root[0] or 1
+    rects = []
+    max_depth = 0
+    pending = [(root, 0, 0.0)]
+    while pending:
+        node, depth, x = pending.pop()
+        max_depth = max(max_depth, depth)
+        for name, child in sorted(node[1].items()):
+            child_width = child[0] / total * width
+            if child_width >= 0.5:  # too narrow to see
+                rects.append((name, child[0], depth, x, child_width))
+                pending.append((child, depth + 1, x))
+            x += child_width
+    
+    height = top + (max_depth + 1) * row_height + 10
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="15">{html.escape(title)}</text>'
+    ]
+    for name, count, depth, x, rect_width in rects:
+        y = height - 10 - (depth + 1) * row_height
+        # Stable warm colour per function name
+        hue = zlib.crc32(name.encode("utf-8")) % 40
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count * 100 / total:.2f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" height="{row_height - 1}" fill="hsl({hue},85%,60%)"/>'
+        )
+        max_chars = int(rect_width / 7)
+        if max_chars >= 3:
+            text = name if len(name) <= max_chars else name[:max_chars - 2] + ".."
+            parts.append(f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{html.escape(text)}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def parse_profile_number(value, default):
+    """Parse a seconds/interval query parameter; ValueError unless it is a finite number"""
+    number = float(value) if value is not None else default
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value}")
+    return number
+
+
+def profile_response(result, profile_format):
+    """Build the HTTP response for a finished profile"""
+    samples, sample_count, elapsed = result
+    if profile_format == "svg":
+        title = f"{sample_count} samples over {elapsed:.1f}s"
+        return Response(render_flamegraph_svg(samples, title), mimetype="image/svg+xml")
+    return Response(format_collapsed_stacks(samples), mimetype="text/plain")
+
+
+stack_sampler = StackSampler()
+
+
+# ============================================================================
+# STATIC ASSETS FEATURE
+# ============================================================================
+
+# CSS and JS under static/ are read once at startup, fingerprinted with a
+# content hash in the file name and precompressed. They are served from
+# memory under /assets/ with a one-year immutable cache lifetime: a changed
+# file gets a new name, so browsers never need to revalidate. Pages are
+# rendered through render_page, whose ETag is derived from the template
+# inputs, so a repeat visit gets a 304 without rendering anything.
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSET_URL_PREFIX = "/assets/"
+ASSET_TYPES = {".css": "text/css", ".js": "text/javascript"}
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSET_HASH_LENGTH = 12
+NETWORK_NAME_TTL = 300  # seconds a looked-up network name is reused
+
+asset_names = {}  # {"js/chat.js": "js/chat.<hash>.js"}
+assets = {}  # {fingerprinted name: {"body", "gzip", "br", "mimetype", "etag"}}
+asset_version = ""  # hash of every asset and template, part of page ETags
+
+
+def build_assets():
+    """Fingerprint and precompress every CSS/JS file under static/"""
+    global asset_names, assets, asset_version
+    built_names, built = {}, {}
+    version = hashlib.sha256()
+    for folder in ("static", "templates"):
+        root = os.path.join(APP_ROOT, folder)
+        for directory, _, filenames in sorted(os.walk(root)):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                with open(path, "rb") as f:
+                    body = f.read()
+                digest = hashlib.sha256(body).hexdigest()[:ASSET_HASH_LENGTH]
+                version.update(digest.encode())
+                stem, extension = os.path.splitext(os.path.relpath(path, root).replace(os.sep, "/"))
+                if folder != "static" or extension not in ASSET_TYPES:
+                    continue
+                name = f"{stem}.{digest}{extension}"
+                compressed_gzip = gzip.compress(body, compresslevel=9, mtime=0)
+                compressed_br = brotli.compress(body) if brotli else None
+                built_names[stem + extension] = name
+                built[name] = {
+                    "body": body,
+                    "gzip": compressed_gzip if len(compressed_gzip) < len(body) else None,
+                    "br": compressed_br if compressed_br and len(compressed_br) < len(body) else None,
+                    "mimetype": ASSET_TYPES[extension],
+                    "etag": digest
+                }
+    asset_names, assets, asset_version = built_names, built, version.hexdigest()[:16]
+
+
+def asset_url(path):
+    """URL of a static file, fingerprinted once the assets are built"""
+    name = asset_names.get(path)
+    if name is None:
+        return url_for("static", filename=path)
+    return ASSET_URL_PREFIX + name
+
+
+def asset_response(name):
+    """Serve a fingerprinted asset in the best encoding the client accepts"""
+    asset = assets.get(name)
+    if asset is None:
+        return Response("Not found", status=404)
+    if request.if_none_match.contains(asset["etag"]):
+        response = Response(status=304)
+    else:
+        encoding = next((encoding for encoding in ("br", "gzip")
+                         if asset[encoding] and encoding in request.accept_encodings), None)
+        response = Response(asset[encoding] if encoding else asset["body"], mimetype=asset["mimetype"])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(asset["etag"])
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+network_name_cache = {"name": None, "expires": 0}
+
+
+def get_network_display():
+    """Return a friendly network name (FQDN if available, otherwise local IP)."""
+    if time.time() < network_name_cache["expires"]:
+        return network_name_cache["name"]
+    try:
+        fqdn = socket.getfqdn()
+        if fqdn and '.' in fqdn and fqdn != socket.gethostname():
+            name = fqdn
+        else:
+            # Fallback to local IP address
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect(("8.8.8.8", 80))
+                name = s.getsockname()[0]
+            finally:
+                s.close()
+    except Exception:
+        name = 'LAN'
+    network_name_cache.update(name=name, expires=time.time() + NETWORK_NAME_TTL)
+    return name
+
+
+def render_page(template, **context):
+    """Render a page with an ETag computed from its inputs; 304 without rendering on a match"""
+    key = json.dumps([template, context, get_network_display(), asset_version],
+                     sort_keys=True, default=sorted, ensure_ascii=False)
+    etag = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render_template(template, **context))
+    response.set_etag(etag)
+    # Pages differ per user and must be revalidated, but revalidating is cheap
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+# ============================================================================
+# STARTUP FEATURE
+# ============================================================================
+
+# Data is loaded by a background thread so the server accepts connections
+# right after import. Phases run in order; once the core ones finish,
+# core_ready is set and Socket.IO connections and data-backed routes are let
+# through. Search and history index catch-up can take much longer on big
+# histories, so they run after that behind indexes_ready. Index writes made
+# meanwhile are queued and replayed in order when the catch-up is done.
+STARTUP_WAIT_TIMEOUT = 30  # seconds a request waits for core data before giving up
+STARTUP_TARGET_MS = 1000  # time-to-first-request budget reported at startup
+
+core_ready = threading.Event()
+indexes_ready = threading.Event()
+startup_phases = []  # [(phase, milliseconds)] in the order they ran
+startup_error = None
+first_request_ms = None
+deferred_index_lock = threading.Lock()
+deferred_index_updates = []  # [(function, args)] waiting for indexes_ready
+startup_thread = None
+
+
+def load_users_data():
+    with users_lock:
+        users_data.update(load_users())
+        registered_usernames.update(username for usernames_dict in users_data.values() for username in usernames_dict)
+
+
+def load_channels_data():
+    load_channels()
+    build_channel_members()
+
+
+def load_history_index():
+    history_index.load()
+    for stream in list(history_index.by_stream):
+        if stream != CHAT_STREAM and stream.split(":", 1)[1] not in channels_data:
+            history_index.drop_stream(stream)  # channel deleted in an earlier run
+    index_missing_history()
+
+
+# (phase name, loader) in load order
+CORE_STARTUP_PHASES = [
+    ("assets", build_assets),
+    ("users", load_users_data),
+    ("read cursors", read_cursors.load),  # before channels, which carry older read state over
+    ("chat", load_chat_messages),
+    ("channels", load_channels_data),
+    ("tags", tag_service.load),
+    ("activity", activity.load),
+]
+INDEX_STARTUP_PHASES = [
+    ("search index", index_missing_chat_messages),
+    ("history index", load_history_index),
+]
+
+
+def run_startup_phases(phases):
+    """Run startup phases in order, recording how long each took"""
+    for name, function in phases:
+        began = time.perf_counter()
+        function()
+        startup_phases.append((name, round((time.perf_counter() - began) * 1000, 1)))
+
+
+def load_in_background():
+    """Run the startup phases, setting the readiness events as they complete"""
+    global startup_error
+    try:
+        run_startup_phases(CORE_STARTUP_PHASES)
+        core_ready.set()
+        run_startup_phases(INDEX_STARTUP_PHASES)
+        with deferred_index_lock:
+            for function, args in deferred_index_updates:
+                function(*args)
+            deferred_index_updates.clear()
+            indexes_ready.set()
+    except Exception as e:
+        with deferred_index_lock:
+            # Nothing will replay the queue now; stop it growing for the life of the server
+            startup_error = repr(e)
+            deferred_index_updates.clear()
+        print(f"Startup phase failed, search and history stay unavailable: {startup_error}")
+        raise
+    finally:
+        print_startup_report()
+
+
+def start_background_loading():
+    """Start loading data unless it is already under way"""
+    global startup_thread
+    if startup_thread is None:
+        startup_phases.append(("import", round((time.perf_counter() - STARTUP_BEGAN) * 1000, 1)))
+        startup_thread = threading.Thread(target=load_in_background, name="startup-loader", daemon=True)
+        startup_thread.start()
+
+
+def print_startup_report():
+    phases = ", ".join(f"{name} {ms:.0f}ms" for name, ms in startup_phases)
+    total = (time.perf_counter() - STARTUP_BEGAN) * 1000
+    status = "ready" if indexes_ready.is_set() else f"FAILED ({startup_error})"
+    print(f"Startup {status} after {total:.0f}ms: {phases}")
+
+
+def record_first_request():
+    """Report time-to-first-request against the startup target"""
+    global first_request_ms
+    if first_request_ms is None:
+        first_request_ms = round((time.perf_counter() - STARTUP_BEGAN) * 1000, 1)
+        verdict = "within" if first_request_ms <= STARTUP_TARGET_MS else "OVER"
+        print(f"First request after {first_request_ms:.0f}ms ({verdict} {STARTUP_TARGET_MS}ms target)")
+
+
+def wait_for_core_data(timeout=STARTUP_WAIT_TIMEOUT):
+    """Block until core data is loaded; False if it is still loading after timeout"""
+    return core_ready.wait(timeout)
+
+
+def after_indexes_ready(function, *args):
+    """Apply an index update now, or queue it until the startup catch-up is done"""
+    with deferred_index_lock:
+        if startup_error is not None:
+            return  # startup failed; new messages are picked up by the next start's catch-up
+        if not indexes_ready.is_set():
+            deferred_index_updates.append((function, args))
+            return
+    function(*args)
+
+
+def get_startup_status():
+    return {
+        "ready": core_ready.is_set(),
+        "indexes_ready": indexes_ready.is_set(),
+        "phases": dict(startup_phases),
+        "first_request_ms": first_request_ms,
+        "target_ms": STARTUP_TARGET_MS,
+        "error": startup_error
+    }
+
+
 def exit_function():
     """Save all data when server stops"""
+    if not core_ready.is_set():
+        return  # nothing was served, and a half-loaded chat window must not overwrite disk
     save_all_chat_messages_to_disk()
+    search_index.flush()
+    history_index.close()
+    tag_service.flush()
+    read_cursors.flush()
+    activity.flush()
+    save_users()
 
 
 
@@ -478,27 +3230,35 @@ def create_app():
 
     socketio.init_app(app)
 
-    def get_network_display():
-        """Return a friendly network name (FQDN if available, otherwise local IP)."""
-        try:
-            fqdn = socket.getfqdn()
-            if fqdn and '.' in fqdn and fqdn != socket.gethostname():
-                return fqdn
-            # Fallback to local IP address
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            try:
-                s.connect(("8.8.8.8", 80))
-                local_ip = s.getsockname()[0]
-            finally:
-                s.close()
-            return local_ip
-        except Exception:
-            return 'LAN'
+    @app.before_request
+    def before_request():
+        record_first_request()
+
+    # ====================================================================
+    # ROUTES - HEALTH
+    # ====================================================================
+
+    @app.route("/health")
+    def health():
+        """Readiness and startup timing; 503 until core data is loaded"""
+        status = get_startup_status()
+        return status, 200 if status["ready"] else 503
 
     @app.context_processor
     def inject_network_name():
         return {"network_name": get_network_display()}
 
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    # ====================================================================
+    # ROUTES - ASSETS
+    # ====================================================================
+
+    @app.route(ASSET_URL_PREFIX + "<path:name>")
+    def asset(name):
+        """Fingerprinted, precompressed static files with immutable caching"""
+        return asset_response(name)
+
     # ====================================================================
     # ROUTES - CORE
     # ====================================================================
@@ -507,14 +3267,18 @@ def create_app():
     def home():
         if "username" not in session or "ip_address" not in session:
             return redirect(url_for("set_username"))
+        if not wait_for_core_data():
+            return "Server is still starting up, try again shortly", 503
         # Verify username is actually tracked for this IP in users.json
         if not is_valid_username_for_ip(session["ip_address"], session["username"]):
             session.clear()
             return redirect(url_for("set_username"))
-        return render_template("home.html", username=session["username"])
+        return render_page("home.html", username=session["username"])
 
     @app.route("/set-username", methods=["GET", "POST"])
     def set_username():
+        if not wait_for_core_data():
+            return "Server is still starting up, try again shortly", 503
         ip_address = request.remote_addr
         session["ip_address"] = ip_address
         change_mode = request.args.get("change") is not None
@@ -541,9 +3305,6 @@ def create_app():
                 session["username"] = username
                 session["ip_address"] = ip_address
                 track_username(ip_address, username)
-                # Reload users data in memory
-                global users_data
-                users_data = load_users()
                 return redirect(url_for("home"))
         
         # Display existing usernames for context if they exist, excluding current username
@@ -561,29 +3322,33 @@ def create_app():
     def chat():
         if "username" not in session or "ip_address" not in session:
             return redirect(url_for("set_username"))
+        if not wait_for_core_data():
+            return "Server is still starting up, try again shortly", 503
         # Verify username is actually tracked for this IP in users.json
         if not is_valid_username_for_ip(session["ip_address"], session["username"]):
             session.clear()
             return redirect(url_for("set_username"))
-        return render_template("chat.html", username=session["username"], ip_address=session.get("ip_address"))
+        return render_page("chat.html", username=session["username"], ip_address=session.get("ip_address"))
 
     @app.route("/channels")
     def channels():
         if "username" not in session or "ip_address" not in session:
             return redirect(url_for("set_username"))
+        if not wait_for_core_data():
+            return "Server is still starting up, try again shortly", 503
         # Verify username is actually tracked for this IP in users.json
         if not is_valid_username_for_ip(session["ip_address"], session["username"]):
             session.clear()
             return redirect(url_for("set_username"))
         
         # Get user's channels
-        user_data = get_user_data(session["ip_address"], session["username"])
+        channels_info = get_user_channel_ids(session["ip_address"], session["username"])
         user_channels = {
-            "created": user_data.get("Channels", {}).get("created", []),
-            "joined": user_data.get("Channels", {}).get("joined", [])
+            "created": sorted(channels_info["created"], key=channel_id_sort_key),
+            "joined": sorted(channels_info["joined"], key=channel_id_sort_key)
         }
         
-        return render_template("channels.html", username=session["username"], ip_address=session.get("ip_address"), user_channels=user_channels)
+        return render_page("channels.html", username=session["username"], ip_address=session.get("ip_address"), user_channels=user_channels)
 
     @app.route("/get-user-ip")
     def get_user_ip():
@@ -600,11 +3365,99 @@ def create_app():
     def server_stats():
         if "username" not in session or "ip_address" not in session:
             return redirect(url_for("set_username"))
+        if not wait_for_core_data():
+            return "Server is still starting up, try again shortly", 503
         # Verify username is actually tracked for this IP in users.json
         if not is_valid_username_for_ip(session["ip_address"], session["username"]):
             session.clear()
             return redirect(url_for("set_username"))
-        return render_template("server_stats.html", username=session["username"])
+        return render_page("server_stats.html", username=session["username"])
+
+    @app.route("/server-stats/profile")
+    def profile():
+        """Sample all thread stacks for N seconds and return the profile (admin only)"""
+        if not is_admin():
+            return {"error": "Not authorized"}, 403
+        profile_format = request.args.get("format", "collapsed")
+        if profile_format not in PROFILE_FORMATS:
+            return {"error": "Invalid format"}, 400
+        try:
+            seconds = min(parse_profile_number(request.args.get("seconds"), PROFILE_DEFAULT_SECONDS), PROFILE_MAX_SECONDS)
+            interval_ms = max(parse_profile_number(request.args.get("interval"), PROFILE_DEFAULT_INTERVAL_MS), PROFILE_MIN_INTERVAL_MS)
+        except ValueError:
+            return {"error": "Invalid seconds or interval"}, 400
+        if not stack_sampler.start(interval_ms / 1000):
+            return {"error": "A profile is already running"}, 409
+        time.sleep(max(seconds, 0))
+        result = stack_sampler.stop()
+        if result is None:
+            return {"error": "The profile was stopped by another request"}, 409
+        return profile_response(result, profile_format)
+
+    @app.route("/server-stats/profile/start", methods=["POST"])
+    def profile_start():
+        """Start sampling until /server-stats/profile/stop is called (admin only)"""
+        if not is_admin():
+            return {"error": "Not authorized"}, 403
+        try:
+            interval_ms = max(parse_profile_number(request.args.get("interval"), PROFILE_DEFAULT_INTERVAL_MS), PROFILE_MIN_INTERVAL_MS)
+        except ValueError:
+            return {"error": "Invalid interval"}, 400
+        if not stack_sampler.start(interval_ms / 1000):
+            return {"error": "A profile is already running"}, 409
+        return {"status": "started"}
+
+    @app.route("/server-stats/profile/stop", methods=["POST"])
+    def profile_stop():
+        """Stop a running profile and return it (admin only)"""
+        if not is_admin():
+            return {"error": "Not authorized"}, 403
+        profile_format = request.args.get("format", "collapsed")
+        if profile_format not in PROFILE_FORMATS:
+            return {"error": "Invalid format"}, 400
+        result = stack_sampler.stop()
+        if result is None:
+            return {"error": "No profile is running"}, 409
+        return profile_response(result, profile_format)
+
+    # ====================================================================
+    # ROUTES - ADMIN
+    # ====================================================================
+
+    @app.route("/admin/export")
+    def export():
+        """Stream chat/channel history as NDJSON or CSV (admin only)"""
+        if not is_admin():
+            return {"error": "Not authorized"}, 403
+        if not wait_for_core_data():
+            return {"error": "Server is still starting up"}, 503
+        
+        export_format = request.args.get("format", "ndjson")
+        scope = request.args.get("scope", "all")
+        if export_format not in EXPORT_FORMATS or scope not in EXPORT_SCOPES:
+            return {"error": "Invalid format or scope"}, 400
+        try:
+            since = parse_time_filter(request.args.get("since"))
+            until = parse_time_filter(request.args.get("until"))
+        except ValueError:
+            return {"error": "Invalid time range"}, 400
+        channel_id = request.args.get("channel") or None
+        compress = request.args.get("gzip") in ("1", "true")
+        
+        chunks = export_history(
+            export_format,
+            compress=compress,
+            scope="channels" if channel_id else scope,
+            channel_id=channel_id,
+            username=request.args.get("user") or None,
+            since=since,
+            until=until
+        )
+        filename = f"history.{export_format}" + (".gz" if compress else "")
+        mimetype = "application/gzip" if compress else ("application/x-ndjson" if export_format == "ndjson" else "text/csv")
+        # No Content-Length, so the response is sent with chunked transfer encoding
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
 
     return app
 
@@ -613,8 +3466,13 @@ def create_app():
 # APP INITIALIZATION
 # ============================================================================
 
+# The export CLI only reads the data files: no startup loading, indexing or save at exit
+EXPORT_CLI = __name__ == "__main__" and sys.argv[1:2] == ["export"]
+
 app = create_app()
-atexit.register(exit_function)
+if not EXPORT_CLI:
+    atexit.register(exit_function)
+    start_background_loading()
 
 
 # ============================================================================
@@ -625,18 +3483,49 @@ atexit.register(exit_function)
 def handle_connect():
     if "username" not in session:
         return False
-    emit("system_message", f"{session['username']} connected.", broadcast=True)
+    if not wait_for_core_data():
+        return False  # the client retries the connection
+    fanout.register(request.sid)
+    # "connected" is announced by the presence task once reconnect churn settles
+    presence.connect(request.sid, session["username"])
+    ensure_presence_task()
 
 
 @socketio.on("disconnect")
 def handle_disconnect():
-    if "username" in session:
-        emit("system_message", f"{session['username']} left.", broadcast=True)
+    fanout.unregister(request.sid)
+    client_wire_formats.pop(request.sid, None)
+    presence.disconnect(request.sid)
+
+
+@socketio.on("presence_heartbeat")
+def handle_presence_heartbeat(data=None):
+    username = session.get("username")
+    if not username:
+        return
+    if presence.heartbeat(request.sid, username):
+        channel_id = (data or {}).get("channel_id")
+        if channel_id in channels_data:
+            view_channel(channel_id)
+
+
+@socketio.on("get_presence")
+def handle_get_presence(data=None):
+    """Send the online users, plus those viewing a channel if one is given"""
+    channel_id = (data or {}).get("channel_id")
+    response = {
+        "online": presence.online_users(),
+        "count": presence.online_count()
+    }
+    if channel_id:
+        response["channel_id"] = channel_id
+        response["channel_online"] = presence.channel_online_users(channel_id)
+        response["channel_count"] = presence.channel_online_count(channel_id)
+    emit("presence", response)
 
 
 @socketio.on("send_message")
 def handle_message(data):
-    global chat_message_id_counter
     username = session.get("username", "Unknown")
     ip_address = session.get("ip_address", None)
     message = data.get("message", "")[:CHAT_MAX_MESSAGE_LENGTH]  # enforce character limit
@@ -654,28 +3543,24 @@ def handle_message(data):
         return
 
     msg = {
-        "id": chat_message_id_counter,
+        "id": id_allocator.next_id(CHAT_STREAM),
         "username": username,
         "message": message,
         "timestamp": datetime.now(),
-        "read_count": 0,
-        "read_users": set(),
         "reply_to_id": reply_to_id,
         "ip_address": ip_address
     }
     
-    # If this is a reply, add the replied-to message info
+    # If this is a reply, store a preview of the replied-to message with it
     if reply_to_id:
-        original_msg = get_message_by_id(reply_to_id)
-        if original_msg:
-            msg["reply_to_username"] = original_msg["username"]
-            msg["reply_to_message"] = original_msg["message"]
+        msg.update(get_reply_preview(CHAT_STREAM, reply_to_id))
     
     chat_messages.append(msg)
+    activity.record(ip_address, username)
     if len(chat_messages) > CHAT_RECENT_LIMIT:
         save_chat_message_to_disk(chat_messages.pop(0))
-
-    chat_message_id_counter += 1
+    after_indexes_ready(search_index.add, msg)
+    after_indexes_ready(history_index.add, CHAT_STREAM, msg)
 
     # Build the response with reply info
     response = {
@@ -683,7 +3568,7 @@ def handle_message(data):
         "username": msg["username"],
         "message": msg["message"],
         "timestamp": msg["timestamp"].isoformat(),
-        "read_count": msg["read_count"],
+        "read_count": 0,
         "reply_to_id": msg.get("reply_to_id"),
         "ip_address": msg.get("ip_address")
     }
@@ -692,28 +3577,36 @@ def handle_message(data):
         response["reply_to_username"] = msg["reply_to_username"]
         response["reply_to_message"] = msg["reply_to_message"]
     
-    emit("chat_message", response, broadcast=True)
+    broadcast_stream_event(CHAT_STREAM, "chat_message", response)
 
 
 @socketio.on("message_read")
 def message_read(data):
+    """Move the reader's chat cursor up to a message and publish the new read counts"""
     msg_id = data.get("id")
     username = session.get("username")
-
-    for msg in chat_messages:
-        if msg['id'] == msg_id:
-            # Don't count the message sender as having read their own message
-            if username not in msg['read_users'] and username != msg['username']:
-                msg['read_users'].add(username)
-                msg['read_count'] = len(msg['read_users'])
-                emit("update_read_count", {"id": msg_id, "read_count": msg['read_count']}, broadcast=True)
-            break
+    if not username or not isinstance(msg_id, int) or not chat_messages or msg_id > chat_messages[-1]["id"]:
+        return
+    
+    previous = read_cursors.advance(CHAT_STREAM, username, msg_id)
+    if previous is None:
+        return  # already read
+    # One event for the whole range, so a long catch-up takes one replay slot
+    counts = {
+        msg["id"]: chat_read_count(msg) for msg in chat_messages
+        # The sender reading their own message doesn't change its count
+        if previous < msg["id"] <= msg_id and msg["username"] != username
+    }
+    if counts:
+        broadcast_stream_event(CHAT_STREAM, "update_read_counts", {"counts": counts})
 
 
 @socketio.on("load_older_messages")
 def load_older_messages(data):
     last_id = data.get("last_id")
     user_ip = session.get("ip_address")
+    # Read the cursor before snapshotting so anything newer is replayed, not lost
+    cursor = get_stream_cursor(CHAT_STREAM)
     
     # Handle None or invalid last_id - load all messages
     if last_id is None or last_id == float('inf'):
@@ -729,7 +3622,7 @@ def load_older_messages(data):
                 "username": msg["username"],
                 "message": msg["message"],
                 "timestamp": msg["timestamp"].isoformat(),
-                "read_count": msg["read_count"],
+                "read_count": chat_read_count(msg),
                 "ip_address": msg.get("ip_address")
             }
             if msg.get("reply_to_id"):
@@ -738,46 +3631,58 @@ def load_older_messages(data):
                 msg_data["reply_to_message"] = msg.get("reply_to_message", "")
             older_messages.append(msg_data)
     
-    # Then, load from disk for messages older than what's in memory
-    if os.path.exists(CHAT_FILE):
-        with open(CHAT_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                parts = line.strip().split('|', 5)
-                if len(parts) >= 4:
-                    msg_id, username, timestamp, *rest = parts
-                    msg_id_int = int(msg_id)
-                    
-                    # Handle multiple formats
-                    if msg_id_int < last_id and msg_id_int not in [m["id"] for m in older_messages]:
-                        if len(rest) == 3:  # New format with reply_to_id and ip: id|username|timestamp|reply_to_id|ip|message
-                            reply_to_id_str, ip_addr, message = rest
-                            reply_to_id = int(reply_to_id_str) if reply_to_id_str else None
-                        elif len(rest) == 2:  # Format with reply_to_id, no ip: id|username|timestamp|reply_to_id|message
-                            reply_to_id_str, message = rest
-                            reply_to_id = int(reply_to_id_str) if reply_to_id_str else None
-                            ip_addr = None
-                        else:  # Old format without reply_to_id: id|username|timestamp|message
-                            message = rest[0]
-                            reply_to_id = None
-                            ip_addr = None
-                        
-                        msg_data = {
-                            "id": msg_id_int,
-                            "username": username,
-                            "message": message,
-                            "timestamp": timestamp,
-                            "read_count": 0,
-                            "ip_address": ip_addr
-                        }
-                        if reply_to_id:
-                            msg_data["reply_to_id"] = reply_to_id
-                            msg_data["reply_to_username"] = ""
-                            msg_data["reply_to_message"] = ""
-                        older_messages.append(msg_data)
+    # Then page older messages out of the search index's doc store
+    oldest_in_memory = chat_messages[0]["id"] if chat_messages else float('inf')
+    if len(older_messages) < 50 and oldest_in_memory > 1:
+        if indexes_ready.is_set():
+            before_id = min(last_id, oldest_in_memory)
+            if before_id == float('inf'):
+                before_id = search_index.max_id + 1
+            for doc in search_index.docs_before(before_id, 50 - len(older_messages)):
+                msg_data = {key: doc[key] for key in ("id", "username", "message", "timestamp") + SEARCH_DOC_FIELDS
+                            if doc.get(key) is not None}
+                msg_data["read_count"] = chat_read_count(msg_data)
+                if msg_data.get("reply_to_id") and "reply_to_username" not in msg_data:
+                    # Stored before previews were kept with replies
+                    msg_data.update(get_reply_preview(CHAT_STREAM, msg_data["reply_to_id"]))
+                    msg_data.setdefault("reply_to_username", "")
+                    msg_data.setdefault("reply_to_message", "")
+                older_messages.append(msg_data)
+        else:
+            emit("system_message", "Older messages are still being indexed, scroll up again shortly")
     
     # Sort by ID and send last 50
     older_messages.sort(key=lambda x: x["id"])
-    emit("older_messages", older_messages[-50:])
+    # Through the client's queue, so the page lands behind broadcasts already queued for it
+    fanout.send(request.sid, "stream_cursor", cursor)
+    fanout.send(request.sid, "older_messages", older_messages[-50:])
+
+
+@socketio.on("search_messages")
+def handle_search_messages(data):
+    """Full-text search over the whole global chat history"""
+    query = data.get("query", "").strip()
+    try:
+        offset = max(int(data.get("offset", 0)), 0)
+        limit = min(max(int(data.get("limit", SEARCH_PAGE_SIZE)), 1), 100)
+    except (TypeError, ValueError):
+        emit("system_message", "Invalid search offset or limit")
+        return
+    
+    if not query:
+        emit("message_search_results", {"query": query, "total": 0, "offset": offset, "results": []})
+        return
+    if not indexes_ready.is_set():
+        emit("system_message", "Search is still being indexed, try again shortly")
+        return
+    
+    total, results = search_index.search(query, offset, limit)
+    emit("message_search_results", {
+        "query": query,
+        "total": total,
+        "offset": offset,
+        "results": results
+    })
 
 
 # ============================================================================
@@ -791,6 +3696,12 @@ def handle_stats_request(data):
     emit("server_stats", stats)
 
 
+@socketio.on("get_activity_stats")
+def handle_get_activity_stats(data=None):
+    """Send message leaderboards and the hourly activity histogram"""
+    emit("activity_stats", activity.summary())
+
+
 @socketio.on("subscribe_stats")
 def handle_subscribe_stats(data):
     """Subscribe to real-time server stats updates"""
@@ -824,8 +3735,9 @@ def handle_delete_message(data):
     # Mark as deleted
     msg["message"] = "[deleted]"
     msg["deleted"] = True
+    after_indexes_ready(search_index.delete, msg_id)
     
-    emit("message_deleted", {"id": msg_id}, broadcast=True)
+    broadcast_stream_event(CHAT_STREAM, "message_deleted", {"id": msg_id})
 
 
 @socketio.on("edit_message")
@@ -856,8 +3768,9 @@ def handle_edit_message(data):
     # Update message
     msg["message"] = new_message
     msg["edited"] = True
+    after_indexes_ready(search_index.update, msg_id, new_message)
     
-    emit("message_edited", {"id": msg_id, "message": new_message}, broadcast=True)
+    broadcast_stream_event(CHAT_STREAM, "message_edited", {"id": msg_id, "message": new_message})
 
 
 # ============================================================================
@@ -905,13 +3818,13 @@ def handle_create_channel(data):
         # Add new tags to channel_tags.json
         add_new_tags(tags)
         
-        emit("channel_created", {
+        broadcast_stream_event(CHANNELS_STREAM, "channel_created", {
             "id": channel_id,
             "title": title,
             "description": description,
             "tags": tags,
             "creator": username
-        }, broadcast=True)
+        })
     except Exception as e:
         print(f"ERROR: Failed to create channel: {str(e)}")
         emit("system_message", f"Failed to create channel: {str(e)}")
@@ -923,7 +3836,19 @@ def handle_search_channels(data):
     tags_filter = data.get("tags", [])
     
     results = search_channels(query, tags_filter if tags_filter else None)
-    emit("search_results", results)
+    emit_encoded("search_results", results)
+
+@socketio.on("autocomplete_tags")
+def handle_autocomplete_tags(data):
+    """Suggest existing tags for what the user has typed so far"""
+    prefix = data.get("prefix", "").strip()
+    tags = tag_service.suggest(prefix) if prefix else []
+    emit("tag_suggestions", {"prefix": prefix, "target": data.get("target"), "tags": tags})
+
+@socketio.on("get_trending_tags")
+def handle_get_trending_tags(data=None):
+    """Send the currently trending tags"""
+    emit("trending_tags", tag_service.top_trending())
 
 @socketio.on("join_channel")
 def handle_join_channel(data):
@@ -937,7 +3862,7 @@ def handle_join_channel(data):
         return
     
     if join_channel(channel_id, username, ip_address):
-        emit("channel_joined", {"channel_id": channel_id, "username": username}, broadcast=True)
+        broadcast_stream_event(CHANNELS_STREAM, "channel_joined", {"channel_id": channel_id, "username": username})
     else:
         emit("system_message", "Failed to join channel")
 
@@ -953,7 +3878,7 @@ def handle_leave_channel(data):
         return
     
     if leave_channel(channel_id, username, ip_address):
-        emit("channel_left", {"channel_id": channel_id, "username": username}, broadcast=True)
+        broadcast_stream_event(CHANNELS_STREAM, "channel_left", {"channel_id": channel_id, "username": username})
     else:
         emit("system_message", "Failed to leave channel")
 
@@ -969,7 +3894,9 @@ def handle_delete_channel(data):
         return
     
     if delete_channel(channel_id, ip_address, username):
-        emit("channel_deleted", {"channel_id": channel_id}, broadcast=True)
+        drop_stream(channel_stream(channel_id))
+        presence.forget_channel(channel_id)
+        broadcast_stream_event(CHANNELS_STREAM, "channel_deleted", {"channel_id": channel_id})
     else:
         emit("system_message", "Failed to delete channel or not authorized")
 
@@ -993,16 +3920,35 @@ def handle_send_channel_message(data):
     msg = add_channel_message(channel_id, username, message, ip_address, reply_to_id)
     
     if msg:
+        read_cursors.advance(channel_stream(channel_id), username, msg["id"])
         response = {
             "id": msg["id"],
             "channel_id": channel_id,
             "username": msg["username"],
             "message": msg["message"],
             "timestamp": msg["timestamp"],
-            "read_count": msg["read_count"],
+            "read_count": 0,
             "reply_to_id": msg.get("reply_to_id")
         }
-        emit("channel_message", response, broadcast=True)
+        if "reply_to_username" in msg:
+            response["reply_to_username"] = msg["reply_to_username"]
+            response["reply_to_message"] = msg["reply_to_message"]
+        broadcast_stream_event(channel_stream(channel_id), "channel_message", response)
+
+def view_channel(channel_id):
+    """Make the current session one of a channel's viewers"""
+    previous_channel = presence.set_channel(request.sid, channel_id)
+    if previous_channel != channel_id:
+        if previous_channel:
+            leave_room(channel_room(previous_channel))
+        join_room(channel_room(channel_id))
+
+@socketio.on("view_channel")
+def handle_view_channel(data):
+    """Re-announce the open channel after a reconnect resumed without reloading it"""
+    channel_id = data.get("channel_id")
+    if channel_id in channels_data:
+        view_channel(channel_id)
 
 @socketio.on("load_channel_messages")
 def handle_load_channel_messages(data):
@@ -1014,11 +3960,20 @@ def handle_load_channel_messages(data):
         emit("system_message", "Channel not found")
         return
     
-    channel_messages = channels_data[channel_id]["messages"]
-    older_messages = [msg for msg in channel_messages if msg["id"] < last_id]
-    older_messages = older_messages[-100:]  # Load last 100 messages
+    # Opening a channel makes this session one of its viewers
+    view_channel(channel_id)
+    
+    stream = channel_stream(channel_id)
+    cursor = get_stream_cursor(stream)
+    older_messages = []
+    for msg in get_channel_messages_before(channel_id, last_id):
+        # Copies: the stored message keeps only its pre-cursor count as a floor
+        msg = {key: value for key, value in msg.items() if key != "read_users"}
+        msg["read_count"] = message_read_count(stream, msg)
+        older_messages.append(msg)
     
-    emit("channel_older_messages", older_messages)
+    fanout.send(request.sid, "stream_cursor", cursor)
+    fanout.send(request.sid, "channel_older_messages", older_messages)
 
 @socketio.on("get_user_channels")
 def handle_get_user_channels():
@@ -1030,40 +3985,189 @@ def handle_get_user_channels():
         emit("system_message", "Not authenticated")
         return
     
-    user_data = get_user_data(ip_address, username)
-    if not user_data:
+    channels_info = get_user_channel_ids(ip_address, username)
+    if channels_info is None:
         emit("system_message", "User data not found")
         return
     
-    channels_info = user_data.get("Channels", {"created": [], "joined": []})
+    cursor = get_stream_cursor(CHANNELS_STREAM)
     user_channels = {
         "created": [],
         "joined": []
     }
     
     # Get info for created channels
-    for channel_id in channels_info.get("created", []):
+    for channel_id in sorted(channels_info.get("created", []), key=channel_id_sort_key):
         if channel_id in channels_data:
+            unread, unread_capped = channel_unread_count(channel_id, username)
             user_channels["created"].append({
                 "id": channel_id,
                 "title": channels_data[channel_id]["title"],
                 "description": channels_data[channel_id]["description"],
                 "tags": channels_data[channel_id]["tags"],
-                "creator": channels_data[channel_id]["creator"]
+                "creator": channels_data[channel_id]["creator"],
+                "unread": unread,
+                "unread_capped": unread_capped
             })
     
     # Get info for joined channels
-    for channel_id in channels_info.get("joined", []):
-        if channel_id in channels_data and channel_id not in channels_info.get("created", []):
+    for channel_id in sorted(channels_info.get("joined", []), key=channel_id_sort_key):
+        if channel_id in channels_data and channel_id not in channels_info.get("created", set()):
+            unread, unread_capped = channel_unread_count(channel_id, username)
             user_channels["joined"].append({
                 "id": channel_id,
                 "title": channels_data[channel_id]["title"],
                 "description": channels_data[channel_id]["description"],
                 "tags": channels_data[channel_id]["tags"],
-                "creator": channels_data[channel_id]["creator"]
+                "creator": channels_data[channel_id]["creator"],
+                "unread": unread,
+                "unread_capped": unread_capped
             })
     
-    emit("user_channels", user_channels)
+    fanout.send(request.sid, "stream_cursor", cursor)
+    fanout.send(request.sid, "user_channels", user_channels)
+
+
+@socketio.on("channel_read")
+def handle_channel_read(data):
+    """Move the reader's cursor in a channel up to a message"""
+    channel_id = data.get("channel_id")
+    msg_id = data.get("id")
+    username = session.get("username")
+    if not username or channel_id not in channels_data or not isinstance(msg_id, int):
+        return
+    messages = channels_data[channel_id]["messages"]
+    if messages and msg_id <= messages[-1]["id"]:
+        read_cursors.advance(channel_stream(channel_id), username, msg_id)
+
+
+# ============================================================================
+# SOCKETIO EVENTS - THREADS
+# ============================================================================
+
+@socketio.on("load_thread")
+def handle_load_thread(data):
+    """Send the whole reply tree around a chat or channel message in one response"""
+    stream = data.get("stream") or CHAT_STREAM  # "chat" or a channel id
+    msg_id = data.get("id")
+    if stream != CHAT_STREAM:
+        if stream not in channels_data:
+            emit("system_message", "Channel not found")
+            return
+        stream = channel_stream(stream)
+    if not isinstance(msg_id, int):
+        emit("system_message", "Invalid message id")
+        return
+    if not indexes_ready.is_set():
+        emit("system_message", "Threads are still being indexed, try again shortly")
+        return
+    
+    thread = load_thread(stream, msg_id)
+    if thread is None:
+        emit("system_message", "Message not found")
+        return
+    thread["stream"] = data.get("stream") or CHAT_STREAM
+    emit("thread", thread)
+
+
+# ============================================================================
+# SOCKETIO EVENTS - MODERATION
+# ============================================================================
+
+@socketio.on("query_history")
+def handle_query_history(data):
+    """Page through chat and channel messages filtered by user, IP and time range"""
+    if not is_admin():
+        emit("system_message", "Not authorized")
+        return
+    
+    stream = data.get("stream")  # "chat", a channel id, or omitted for everything
+    if stream and stream != CHAT_STREAM:
+        stream = channel_stream(stream)
+    try:
+        since = parse_time_filter(data.get("since"))
+        until = parse_time_filter(data.get("until"))
+    except ValueError:
+        emit("system_message", "Invalid time range")
+        return
+    try:
+        limit = min(max(int(data.get("limit", HISTORY_PAGE_SIZE)), 1), 500)
+    except (TypeError, ValueError):
+        emit("system_message", "Invalid limit")
+        return
+    if not indexes_ready.is_set():
+        emit("system_message", "History is still being indexed, try again shortly")
+        return
+    
+    matches, next_cursor = history_index.query(
+        username=data.get("username") or None,
+        ip_address=data.get("ip_address") or None,
+        stream=stream or None,
+        since=since,
+        until=until,
+        before=data.get("cursor"),
+        limit=limit
+    )
+    
+    results = []
+    for match_stream, msg_id, _ in matches:
+        msg = get_stored_message(match_stream, msg_id)
+        if msg is None:
+            continue  # channel was deleted
+        result = {
+            "stream": CHAT_STREAM if match_stream == CHAT_STREAM else "channel",
+            "id": msg_id,
+            "username": msg["username"],
+            "message": msg["message"],
+            "timestamp": msg["timestamp"],
+            "ip_address": msg.get("ip_address")
+        }
+        if match_stream != CHAT_STREAM:
+            result["channel_id"] = match_stream.split(":", 1)[1]
+        results.append(result)
+    
+    emit("history_query_results", {"results": results, "cursor": next_cursor})
+
+
+# ============================================================================
+# SOCKETIO EVENTS - WIRE FORMAT
+# ============================================================================
+
+@socketio.on("set_wire_format")
+def handle_set_wire_format(data):
+    """Switch the current client between the verbose and compact payload formats"""
+    wire_format = data.get("format", "json")
+    if wire_format not in WIRE_FORMATS:
+        emit("system_message", f"Unknown wire format '{wire_format}'")
+        return
+    
+    client_wire_formats[request.sid] = wire_format
+    emit("wire_format", {"format": wire_format})
+
+
+# ============================================================================
+# SOCKETIO EVENTS - RECONNECT
+# ============================================================================
+
+@socketio.on("resume_streams")
+def handle_resume_streams(data):
+    """Replay the events a reconnecting client missed on each stream it follows"""
+    epoch = data.get("epoch")
+    cursors = data.get("cursors", {})
+    
+    for stream, last_seq in cursors.items():
+        missed = None
+        if epoch == REPLAY_EPOCH and isinstance(last_seq, int):
+            missed = get_missed_events(stream, last_seq)
+        if missed is None:
+            # Cursor is from a previous server run or fell out of the buffer
+            fanout.send(request.sid, "resume_failed", {"stream": stream})
+            continue
+        # Through the client's queue, so replays stay in order with live broadcasts
+        for event, payload in missed:
+            fanout.send(request.sid, event, payload)
+    
+    fanout.send(request.sid, "resume_complete", {"streams": list(cursors)})
 
 
 # ============================================================================
@@ -1071,4 +4175,7 @@ def handle_get_user_channels():
 # ============================================================================
 
 if __name__ == "__main__":
-    socketio.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    if EXPORT_CLI:
+        run_export_cli(sys.argv[2:])
+    else:
+        socketio.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
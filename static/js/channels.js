@@ -0,0 +1,425 @@
+const socket = io();
+let currentChannel = null;
+let currentUsername = LAN_HUB.username;
+let currentUserIP = LAN_HUB.ipAddress;
+let messagesDiv = document.getElementById("messages");
+let replyingToId = null;
+let replyingToData = null;
+let userChannels = { created: [], joined: [] };
+let replayEpoch = null; // Server run the cursors belong to (null until the first full load)
+let streamSeqs = {}; // Last event seen per stream ("channels", "channel:<id>")
+const messagesMap = new Map(); // Messages of the open channel by ID, shown once each
+
+// Empty the message view, e.g. before another channel is loaded
+function clearMessages() {
+    messagesDiv.innerHTML = "";
+    messagesMap.clear();
+}
+
+// Remember the newest event of a stream so a reconnect can resume from it
+function trackSeq(stream, data) {
+    if (data.seq) {
+        streamSeqs[stream] = Math.max(streamSeqs[stream] || 0, data.seq);
+    }
+}
+
+function reloadCurrentChannel() {
+    clearMessages();
+    delete streamSeqs["channel:" + currentChannel];
+    socket.emit("load_channel_messages", { channel_id: currentChannel });
+}
+
+// Load user channels on connection, or only what was missed on reconnect
+socket.on("connect", () => {
+    socket.emit("set_wire_format", { format: "compact" });
+    socket.emit("get_trending_tags");
+    if (replayEpoch !== null && streamSeqs.channels !== undefined) {
+        const cursors = { channels: streamSeqs.channels };
+        const channelKey = "channel:" + currentChannel;
+        if (currentChannel && streamSeqs[channelKey] !== undefined) {
+            cursors[channelKey] = streamSeqs[channelKey];
+        }
+        socket.emit("resume_streams", { epoch: replayEpoch, cursors });
+        if (currentChannel && cursors[channelKey] === undefined) {
+            reloadCurrentChannel();
+        } else if (currentChannel) {
+            // The new connection is not a viewer of the open channel yet
+            socket.emit("view_channel", { channel_id: currentChannel });
+            socket.emit("get_presence", { channel_id: currentChannel });
+        }
+    } else {
+        replayEpoch = null;
+        streamSeqs = {};
+        socket.emit("get_user_channels");
+        if (currentChannel) {
+            reloadCurrentChannel();
+        }
+    }
+});
+
+reconnectOnServerDisconnect(socket);
+
+// Presence: keep this session alive and show who is viewing the open channel
+startPresenceHeartbeat(socket, () => ({ channel_id: currentChannel }));
+
+socket.on("presence", (data) => {
+    if (data.channel_id === currentChannel) {
+        document.getElementById("channelOnline").textContent = data.channel_count;
+    }
+});
+
+socket.on("channel_presence_delta", (data) => {
+    if (data.channel_id === currentChannel) {
+        document.getElementById("channelOnline").textContent = data.count;
+    }
+});
+
+socket.on("stream_cursor", (data) => {
+    if (replayEpoch !== data.epoch) {
+        replayEpoch = data.epoch;
+        streamSeqs = {};
+    }
+    streamSeqs[data.stream] = Math.max(streamSeqs[data.stream] || 0, data.seq);
+});
+
+socket.on("resume_failed", (data) => {
+    if (data.stream === "channels") {
+        delete streamSeqs.channels;
+        socket.emit("get_user_channels");
+    } else if (currentChannel && data.stream === "channel:" + currentChannel) {
+        reloadCurrentChannel();
+    }
+});
+
+// The server discarded events this client was too slow to receive
+socket.on("events_dropped", () => {
+    delete streamSeqs.channels;
+    socket.emit("get_user_channels");
+    if (currentChannel) {
+        reloadCurrentChannel();
+    }
+});
+
+socket.on("user_channels", (data) => {
+    userChannels = data;
+    renderChannelTabs();
+});
+
+socket.on("channel_message", (data) => {
+    data = decodeMessage(data);
+    trackSeq("channel:" + data.channel_id, data);
+    if (data.channel_id === currentChannel) {
+        displayMessage(data);
+        socket.emit("channel_read", { channel_id: currentChannel, id: data.id });
+    } else if (data.username !== currentUsername) {
+        // Bump the unread badge of a channel that isn't open
+        const channel = [...userChannels.created, ...userChannels.joined].find(c => c.id === data.channel_id);
+        if (channel) {
+            channel.unread = (channel.unread || 0) + 1;
+            renderChannelTabs();
+        }
+    }
+});
+
+socket.on("channel_older_messages", (messages) => {
+    messages = decodeBatch(messages);
+    messages.forEach(msg => displayMessage(msg));
+    if (currentChannel && messages.length) {
+        socket.emit("channel_read", { channel_id: currentChannel, id: Math.max(...messages.map(msg => msg.id)) });
+    }
+});
+
+socket.on("channel_created", (data) => {
+    trackSeq("channels", data);
+    socket.emit("get_trending_tags");
+    userChannels.created.push(data);
+    renderChannelTabs();
+});
+
+socket.on("system_message", (message) => {
+    alert(message);
+});
+
+socket.on("channel_joined", (data) => {
+    trackSeq("channels", data);
+    socket.emit("get_user_channels");
+});
+
+socket.on("channel_left", (data) => {
+    trackSeq("channels", data);
+    if (data.channel_id === currentChannel) {
+        currentChannel = null;
+        clearMessages();
+        document.getElementById("channelHeader").style.display = "none";
+    }
+    socket.emit("get_user_channels");
+});
+
+socket.on("channel_deleted", (data) => {
+    trackSeq("channels", data);
+    if (data.channel_id === currentChannel) {
+        currentChannel = null;
+        clearMessages();
+        document.getElementById("channelHeader").style.display = "none";
+    }
+    socket.emit("get_user_channels");
+});
+
+function renderChannelTabs() {
+    const createdDiv = document.getElementById("createdChannels");
+    const joinedDiv = document.getElementById("joinedChannels");
+    
+    createdDiv.innerHTML = "";
+    joinedDiv.innerHTML = "";
+    
+    userChannels.created.forEach(channel => {
+        const tab = createChannelTab(channel, true);
+        createdDiv.appendChild(tab);
+    });
+    
+    userChannels.joined.forEach(channel => {
+        const tab = createChannelTab(channel, false);
+        joinedDiv.appendChild(tab);
+    });
+}
+
+function createChannelTab(channel, isCreator) {
+    const div = document.createElement("div");
+    div.className = `channel-tab ${currentChannel === channel.id ? 'active' : ''}`;
+    div.style.cursor = "pointer";
+    
+    const nameSpan = document.createElement("span");
+    nameSpan.textContent = channel.title;
+    nameSpan.style.flex = "1";
+    nameSpan.onclick = () => selectChannel(channel);
+    
+    if (channel.unread && currentChannel !== channel.id) {
+        const badge = document.createElement("span");
+        badge.className = "unread-badge";
+        badge.textContent = channel.unread + (channel.unread_capped ? "+" : "");
+        nameSpan.appendChild(badge);
+    }
+    
+    const actions = document.createElement("div");
+    actions.className = "channel-actions";
+    
+    if (isCreator) {
+        const deleteBtn = document.createElement("button");
+        deleteBtn.className = "action-btn";
+        deleteBtn.textContent = "✕";
+        deleteBtn.onclick = (e) => {
+            e.stopPropagation();
+            if (confirm("Delete this channel?")) {
+                socket.emit("delete_channel", { channel_id: channel.id });
+            }
+        };
+        actions.appendChild(deleteBtn);
+    } else {
+        const leaveBtn = document.createElement("button");
+        leaveBtn.className = "action-btn";
+        leaveBtn.textContent = "✕";
+        leaveBtn.onclick = (e) => {
+            e.stopPropagation();
+            socket.emit("leave_channel", { channel_id: channel.id });
+        };
+        actions.appendChild(leaveBtn);
+    }
+    
+    div.appendChild(nameSpan);
+    div.appendChild(actions);
+    return div;
+}
+
+function selectChannel(channel) {
+    currentChannel = channel.id;
+    channel.unread = 0;
+    channel.unread_capped = false;
+    event.currentTarget.querySelector(".unread-badge")?.remove();
+    clearMessages();
+    delete streamSeqs["channel:" + channel.id];
+    
+    document.querySelectorAll(".channel-tab").forEach(tab => {
+        tab.classList.remove("active");
+    });
+    event.currentTarget.classList.add("active");
+    
+    // Display channel header
+    document.getElementById("channelHeader").style.display = "block";
+    document.getElementById("channelTitle").textContent = channel.title;
+    document.getElementById("channelDescription").textContent = channel.description;
+    document.getElementById("channelCreator").textContent = channel.creator;
+    
+    const tagsDiv = document.getElementById("channelTags");
+    tagsDiv.innerHTML = channel.tags.map(tag => `<span class="tag">${tag}</span>`).join("");
+    
+    // Load messages
+    socket.emit("load_channel_messages", { channel_id: channel.id });
+    socket.emit("get_presence", { channel_id: channel.id });
+}
+
+function displayMessage(data) {
+    if (messagesMap.has(data.id)) return; // Already shown by a history load, live event or replay
+    messagesMap.set(data.id, data);
+    const messageDiv = document.createElement("div");
+    messageDiv.className = "message-group";
+    messageDiv.innerHTML = `
+        <div class="message-bubble other">
+            <div class="message-header">
+                <span class="message-username">${data.username}</span>
+            </div>
+            <div class="message-body">${escapeHtml(data.message)}</div>
+            <div class="message-footer">
+                <span>${new Date(data.timestamp).toLocaleString()}</span>
+            </div>
+        </div>
+    `;
+    messagesDiv.appendChild(messageDiv);
+}
+
+function sendMessage() {
+    const input = document.getElementById("messageInput");
+    const message = input.value.trim();
+    
+    if (!currentChannel || !message) return;
+    
+    socket.emit("send_channel_message", {
+        channel_id: currentChannel,
+        message: message,
+        reply_to_id: replyingToId
+    });
+    
+    input.value = "";
+    cancelReply();
+}
+
+function cancelReply() {
+    replyingToId = null;
+    document.getElementById("replyContext").style.display = "none";
+}
+
+function openCreateChannelModal() {
+    document.getElementById("createChannelModal").classList.add("active");
+}
+
+function closeCreateChannelModal() {
+    document.getElementById("createChannelModal").classList.remove("active");
+    document.getElementById("newChannelTitle").value = "";
+    document.getElementById("newChannelDescription").value = "";
+    document.getElementById("newChannelTags").value = "";
+    document.getElementById("newChannelTagSuggestions").innerHTML = "";
+}
+
+function createChannel() {
+    const title = document.getElementById("newChannelTitle").value.trim();
+    const description = document.getElementById("newChannelDescription").value.trim();
+    const tagsStr = document.getElementById("newChannelTags").value.trim();
+    const tags = tagsStr ? tagsStr.split(",").map(t => t.trim()).filter(t => t) : [];
+    
+    if (!title) {
+        alert("Channel title is required");
+        return;
+    }
+    
+    // Note: Client-side validation only - server will also validate with is_blacklisted function
+    // Send to server for backend validation including blacklist checking
+    socket.emit("create_channel", { title, description, tags });
+    closeCreateChannelModal();
+}
+
+function searchChannels() {
+    const query = document.getElementById("searchInput").value;
+    socket.emit("autocomplete_tags", { prefix: query.trim(), target: "search" });
+    if (query.length < 2) {
+        document.getElementById("searchResults").classList.remove("active");
+        return;
+    }
+    
+    socket.emit("search_channels", { query });
+}
+
+function searchByTag(tag) {
+    document.getElementById("searchInput").value = "";
+    document.getElementById("searchTagSuggestions").innerHTML = "";
+    socket.emit("search_channels", { query: "", tags: [tag] });
+}
+
+// Render tags as clickable chips
+function renderTagChips(container, tags, onPick) {
+    container.innerHTML = "";
+    tags.forEach(tag => {
+        const chip = document.createElement("span");
+        chip.className = "tag clickable";
+        chip.textContent = tag.name;
+        chip.title = `${tag.count} channel${tag.count === 1 ? "" : "s"}`;
+        chip.onclick = () => onPick(tag.name);
+        container.appendChild(chip);
+    });
+}
+
+// Suggest existing tags for the one currently being typed in the create modal
+document.getElementById("newChannelTags").addEventListener("input", function() {
+    const fragment = this.value.split(",").pop().trim();
+    socket.emit("autocomplete_tags", { prefix: fragment, target: "create" });
+});
+
+function completeNewChannelTag(name) {
+    const input = document.getElementById("newChannelTags");
+    const parts = input.value.split(",");
+    parts[parts.length - 1] = (parts.length > 1 ? " " : "") + name;
+    input.value = parts.join(",") + ", ";
+    document.getElementById("newChannelTagSuggestions").innerHTML = "";
+    input.focus();
+}
+
+socket.on("tag_suggestions", (data) => {
+    if (data.target === "create") {
+        renderTagChips(document.getElementById("newChannelTagSuggestions"), data.tags, completeNewChannelTag);
+    } else if (data.target === "search") {
+        renderTagChips(document.getElementById("searchTagSuggestions"), data.tags, searchByTag);
+    }
+});
+
+socket.on("trending_tags", (tags) => {
+    renderTagChips(document.getElementById("trendingTags"), tags, searchByTag);
+});
+
+socket.on("search_results", (results) => {
+    results = decodeBatch(results, CHANNEL_KEYS);
+    const resultsDiv = document.getElementById("searchResults");
+    resultsDiv.innerHTML = "";
+    
+    results.forEach(channel => {
+        const item = document.createElement("div");
+        item.className = "search-result-item";
+        item.innerHTML = `
+            <div class="result-title">${channel.title}</div>
+            <div class="result-creator">By ${channel.creator}</div>
+            <button onclick="joinChannelFromSearch('${channel.id}')" style="margin-top: 6px; padding: 6px 12px; background: var(--primary-red); color: white; border: none; border-radius: 4px; cursor: pointer; font-size: 0.85rem;">Join</button>
+        `;
+        resultsDiv.appendChild(item);
+    });
+    
+    resultsDiv.classList.add("active");
+});
+
+function joinChannelFromSearch(channelId) {
+    socket.emit("join_channel", { channel_id: channelId });
+}
+
+document.getElementById("messageInput").addEventListener("keydown", function(event) {
+    if (event.key === "Enter" && !event.shiftKey) {
+        event.preventDefault();
+        sendMessage();
+    }
+});
+
+function escapeHtml(text) {
+    const map = {
+        '&': '&amp;',
+        '<': '&lt;',
+        '>': '&gt;',
+        '"': '&quot;',
+        "'": '&#039;'
+    };
+    return text.replace(/[&<>"']/g, m => map[m]);
+}
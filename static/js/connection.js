@@ -0,0 +1,30 @@
+// Presence: keep this session alive while the page is open. A heartbeat also
+// re-registers a session the server expired (e.g. while a background tab's
+// timers were throttled), so it carries whatever the page is viewing.
+const PRESENCE_HEARTBEAT_INTERVAL = 25000; // 25 seconds
+
+function startPresenceHeartbeat(socket, details = () => ({})) {
+    const beat = () => {
+        if (socket.connected) {
+            socket.emit("presence_heartbeat", details());
+        }
+    };
+    setInterval(beat, PRESENCE_HEARTBEAT_INTERVAL);
+    // Beats may have been skipped while the tab was hidden
+    document.addEventListener("visibilitychange", () => {
+        if (document.visibilityState === "visible") {
+            beat();
+        }
+    });
+}
+
+// Socket.IO only reconnects by itself after a transport failure. When the
+// server ends the connection (e.g. a client too slow to keep up with
+// broadcasts), connect again; the page's "connect" handler then resumes.
+function reconnectOnServerDisconnect(socket) {
+    socket.on("disconnect", (reason) => {
+        if (reason === "io server disconnect") {
+            socket.connect();
+        }
+    });
+}
@@ -0,0 +1,91 @@
+const socket = io();
+const STATS_INTERVAL = 3000; // 3 seconds
+
+function updateStats(data) {
+    // RAM
+    document.getElementById("ram-used").textContent = data.ram.used_gb;
+    document.getElementById("ram-total").textContent = data.ram.total_gb;
+    document.getElementById("ram-percent").textContent = data.ram.percent;
+    document.getElementById("ram-bar").style.width = data.ram.percent + "%";
+    
+    // CPU
+    document.getElementById("cpu-count").textContent = data.cpu.count;
+    document.getElementById("cpu-percent").textContent = data.cpu.percent;
+    document.getElementById("cpu-bar").style.width = data.cpu.percent + "%";
+    
+    // Disk
+    document.getElementById("disk-used").textContent = data.disk.used_gb;
+    document.getElementById("disk-total").textContent = data.disk.total_gb;
+    document.getElementById("disk-percent").textContent = data.disk.percent;
+    document.getElementById("disk-bar").style.width = data.disk.percent + "%";
+    
+    // Network
+    document.getElementById("net-interfaces").textContent = data.network.active_interfaces;
+    document.getElementById("net-connections").textContent = data.network.connections;
+    
+    // Outbound queues
+    document.getElementById("outbound-queued").textContent = data.outbound.queued;
+    document.getElementById("outbound-lagging").textContent = data.outbound.lagging;
+    document.getElementById("outbound-dropped").textContent = data.outbound.dropped;
+    document.getElementById("outbound-disconnects").textContent = data.outbound.slow_disconnects;
+    document.getElementById("outbound-delay").textContent = data.outbound.avg_delay_ms;
+    
+    // Timestamp
+    const date = new Date(data.timestamp);
+    document.getElementById("last-updated").textContent = date.toLocaleTimeString();
+}
+
+socket.on("server_stats", (data) => {
+    updateStats(data);
+});
+
+function fillList(id, items, describe) {
+    const list = document.getElementById(id);
+    list.innerHTML = "";
+    if (items.length === 0) {
+        list.innerHTML = "<li>No messages yet</li>";
+        return;
+    }
+    items.forEach(item => {
+        const li = document.createElement("li");
+        li.textContent = describe(item);
+        list.appendChild(li);
+    });
+}
+
+function updateActivity(data) {
+    document.getElementById("active-users").textContent = data.active_users_last_hour;
+    
+    const histogram = document.getElementById("activity-histogram");
+    const peak = Math.max(1, ...data.hourly.map(bucket => bucket.count));
+    histogram.innerHTML = "";
+    data.hourly.forEach(bucket => {
+        const bar = document.createElement("div");
+        bar.style.cssText = `flex: 1; background: #dc3545; min-height: 1px; height: ${bucket.count / peak * 100}%;`;
+        bar.title = `${new Date(bucket.hour * 1000).toLocaleTimeString([], {hour: "2-digit", minute: "2-digit"})}: ${bucket.count} messages`;
+        histogram.appendChild(bar);
+    });
+    
+    fillList("top-users", data.top_users, user => `${user.username}: ${user.messages} messages (${user.last_hour} in the last hour)`);
+    fillList("top-channels", data.top_channels, channel => `${channel.title}: ${channel.last_hour} in the last hour (${channel.messages} total)`);
+}
+
+socket.on("activity_stats", (data) => {
+    updateActivity(data);
+});
+
+reconnectOnServerDisconnect(socket);
+
+// Presence: this page counts as being online too
+startPresenceHeartbeat(socket);
+
+function requestStats() {
+    if (socket.connected) {
+        socket.emit("request_stats", {});
+        socket.emit("get_activity_stats");
+    }
+}
+
+// Request stats on connect and then every 3 seconds (one timer across reconnects)
+socket.on("connect", requestStats);
+setInterval(requestStats, STATS_INTERVAL);
@@ -0,0 +1,35 @@
+// Compact wire format: short keys back to field names (mirrors the server's key maps)
+const MESSAGE_KEYS = {i: "id", c: "channel_id", u: "username", m: "message", t: "timestamp", r: "read_count", p: "reply_to_id", pu: "reply_to_username", pm: "reply_to_message", a: "ip_address", e: "edited", s: "seq"};
+const CHANNEL_KEYS = {i: "id", n: "title", d: "description", g: "tags", u: "creator", k: "member_count"};
+
+function expandRow(row, keys) {
+    const obj = {};
+    for (const [key, value] of Object.entries(row)) {
+        obj[keys[key] || key] = value;
+    }
+    return obj;
+}
+
+function expandColumns(batch, keys) {
+    const rows = [];
+    for (let n = 0; n < batch.n; n++) {
+        rows.push({});
+    }
+    for (const [key, column] of Object.entries(batch.cols)) {
+        const field = keys[key] || key;
+        const fromDictionary = batch.dk.includes(key);
+        column.forEach((value, n) => {
+            rows[n][field] = (fromDictionary && value !== null) ? batch.d[value] : value;
+        });
+    }
+    return rows;
+}
+
+// Accept both formats, since replies to requests sent before the switch may still be verbose
+function decodeMessage(data) {
+    return data.id === undefined ? expandRow(data, MESSAGE_KEYS) : data;
+}
+
+function decodeBatch(data, keys = MESSAGE_KEYS) {
+    return Array.isArray(data) ? data : expandColumns(data, keys);
+}